@@ -1,59 +1,34 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, g
 import time
 import os
+import json
+import base64
+import hashlib
+import math
+import sys
+import logging
+import threading
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta
-import pytz
+from sqlalchemy import inspect, or_, text
 
 # ------------------------------------------------------------------
-# PARTE 1: Lógica da Árvore Binária de Busca (BST)
+# PARTE 1: Índice Ordenado de Eventos (substitui a ABB)
 # ------------------------------------------------------------------
 
-class Node:
-    """Representa um nó na Árvore Binária de Busca."""
-    def __init__(self, key, data):
-        self.key = key
-        self.data = data
-        self.left = None
-        self.right = None
-
-class BinarySearchTree:
-    """Implementa a lógica da Árvore Binária de Busca (ABB)."""
-    def __init__(self):
-        self.root = None
-
-    def insert(self, key, data):
-        """Insere um novo evento na ABB com base no timestamp (key)."""
-        if self.root is None:
-            self.root = Node(key, data)
-        else:
-            self._insert_recursive(self.root, key, data)
-
-    def _insert_recursive(self, node, key, data):
-        """Função auxiliar recursiva para inserção."""
-        if key < node.key:
-            if node.left is None:
-                node.left = Node(key, data)
-            else:
-                self._insert_recursive(node.left, key, data)
-        elif key > node.key:
-            if node.right is None:
-                node.right = Node(key, data)
-            else:
-                self._insert_recursive(node.right, key, data)
-
-    def inorder_traversal(self, node):
-        """Percorre a árvore em ordem (Inorder) para retornar os eventos."""
-        res = []
-        if node:
-            res.extend(self.inorder_traversal(node.left))
-            res.append({"key": node.key, "data": node.data})
-            res.extend(self.inorder_traversal(node.right))
-        return res
-
-    def get_all_events_sorted(self):
-        """Função wrapper para obter todos os eventos ordenados."""
-        return self.inorder_traversal(self.root)
+# A implementação do índice fica em bst.py (blocos ordenados, sem recursão),
+# para que o carregamento e a API não dependam da ordem de inserção.
+from bst import OrderedEventIndex, StringTable, texto_acel
+from risco import RiskAggregates, contagens_por_varredura, gerar_alertas
+from risco_vetorizado import analisar_colunas, carregar_colunas, rotulos_de_tipo, semear_agregados
+from ingestao import GroupCommitWriter
+from feed_eventos import EventChangeFeed
+from particoes import PartitionManager
+from stream_eventos import EventBroadcaster
+from serializacao import eventos_json
+from geoespacial import GridIndex
+from monitoramento import AsyncLogHandler, MetricsRegistry, RequestProfiler
+from snapshot import VERSAO, EventLog, colunas_de_registros, gravar_snapshot, ler_snapshot
+import numpy as np
 
 # ------------------------------------------------------------------
 # PARTE 2: Webservice Flask E Configuração do Banco de Dados
@@ -61,6 +36,15 @@ class BinarySearchTree:
 
 app = Flask(__name__)
 
+# Logs vão para uma fila e são escritos por uma thread, fora do caminho das
+# requisições (LOG_NIVEL=DEBUG mostra também cada lote gravado).
+LOG_HANDLER = AsyncLogHandler(sys.stdout)
+LOG_HANDLER.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(message)s"))
+log = logging.getLogger("cuida")
+log.addHandler(LOG_HANDLER)
+log.setLevel(os.environ.get('LOG_NIVEL', 'INFO').upper())
+log.propagate = False
+
 DATABASE_URL = os.environ.get('DATABASE_URL')
 if DATABASE_URL:
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
@@ -71,76 +55,637 @@ app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
-FALL_DATA_TREE = BinarySearchTree() 
+def _descartar_conexoes_herdadas():
+    # Workers do gunicorn criados com --preload herdam o pool de conexões do
+    # processo mestre; cada um precisa abrir as suas.
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_descartar_conexoes_herdadas)
+
+# Chave composta (timestamp, id do DB): eventos no mesmo segundo não colidem.
+FALL_DATA_TREE = OrderedEventIndex()
+# Protege o índice entre a thread de group commit e as leituras da API.
+INDICE_LOCK = threading.Lock()
+# Contagens da análise de risco, atualizadas a cada evento gravado.
+RISK_AGGREGATES = RiskAggregates()
+# Grade espacial (lat/lon) dos mesmos eventos, para as consultas por área.
+GEO_INDEX = GridIndex(passo=float(os.environ.get('GEO_CELULA_GRAUS', '0.01')))
+# Repassa cada evento aplicado no índice aos clientes de /api/eventos/stream.
+BROADCASTER = EventBroadcaster(capacidade=int(os.environ.get('STREAM_CAPACIDADE', '1000')))
+# Cauda da tabela Evento: traz para este worker o que os outros gravaram.
+EVENT_FEED = EventChangeFeed(intervalo=float(os.environ.get('FEED_INTERVALO_MS', '100')) / 1000.0)
+
+# Snapshot binário do índice + log dos eventos gravados depois dele, para
+# reiniciar sem reler a tabela inteira (SNAPSHOT_ATIVO=0 desliga).
+SNAPSHOT_ATIVO = os.environ.get('SNAPSHOT_ATIVO', '1') == '1'
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', app.instance_path)
+# Os arquivos levam um resumo da URL do banco e da versão do formato:
+# snapshots de outro DB (ou de outro layout de registro) nunca são lidos.
+_SUFIXO_SNAPSHOT = hashlib.sha1(f"{DATABASE_URL}|{VERSAO}".encode()).hexdigest()[:8]
+SNAPSHOT_PATH = os.path.join(SNAPSHOT_DIR, f'eventos-{_SUFIXO_SNAPSHOT}.snap')
+# Passando de SNAPSHOT_MAX_WAL eventos no log, o snapshot é regravado em
+# segundo plano, sem esperar o próximo reinício.
+SNAPSHOT_MAX_WAL = int(os.environ.get('SNAPSHOT_MAX_WAL', '100000'))
+EVENT_LOG = EventLog(os.path.join(SNAPSHOT_DIR, f'eventos-{_SUFIXO_SNAPSHOT}.wal'))
+
+DISPOSITIVO_PADRAO = 'padrao'
+# Tamanho (em caracteres) das colunas de texto de Evento, também aplicado
+# na validação dos eventos recebidos.
+CARACTERES_TEXTO = {"tipo": 50, "acel": 50, "dispositivo": 64}
 
 class Evento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.BigInteger, nullable=False, index=True)
-    tipo = db.Column(db.String(50), nullable=False)
+    tipo = db.Column(db.String(CARACTERES_TEXTO['tipo']), nullable=False)
     lat = db.Column(db.Float, nullable=False)
     lon = db.Column(db.Float, nullable=False)
-    acel = db.Column(db.String(50))
+    acel = db.Column(db.String(CARACTERES_TEXTO['acel']))
+    # Identifica o ESP32/paciente; eventos antigos ficam no dispositivo padrão.
+    dispositivo = db.Column(db.String(CARACTERES_TEXTO['dispositivo']), nullable=False,
+                            default=DISPOSITIVO_PADRAO, server_default=DISPOSITIVO_PADRAO)
+
+    __table_args__ = (
+        db.Index('ix_evento_dispositivo_timestamp', 'dispositivo', 'timestamp'),
+    )
+
+def carregar_particao(particao):
+    """Carrega do DB só os eventos de um dispositivo (índice composto)."""
+    linhas = (db.session.query(Evento.id, Evento.timestamp, Evento.tipo,
+                               Evento.lat, Evento.lon, Evento.acel)
+              .filter(Evento.dispositivo == particao.dispositivo)
+              .order_by(Evento.timestamp, Evento.id).all())
+    agora = time.time()
+    for evento_id, timestamp, tipo, lat, lon, acel in linhas:
+        particao.agregados.add(timestamp, tipo, agora)
+    particao.indice.bulk_load(
+        ((timestamp, evento_id),
+         {"tipo": tipo, "lat": lat, "lon": lon, "acel": acel, "dispositivo": particao.dispositivo})
+        for evento_id, timestamp, tipo, lat, lon, acel in linhas
+    )
+    db.session.close()
+
+def dispositivo_conhecido(dispositivo):
+    """Se algum evento do índice global tem esse texto (só esses ganham partição)."""
+    with INDICE_LOCK:
+        return FALL_DATA_TREE.textos.existente(dispositivo) is not None
+
+# Índices e agregados por dispositivo, carregados sob demanda e descartados
+# quando ociosos, quando passam de PARTICOES_MAX partições ou quando o total
+# de eventos nelas passa do limite. Um ?dispositivo= desconhecido não cria
+# partição nem consulta o DB.
+# PARTICOES_MAX_EVENTOS não limita a memória do processo: FALL_DATA_TREE e
+# GEO_INDEX guardam todos os eventos; o limite cobre só as cópias por dispositivo.
+PARTICOES = PartitionManager(
+    carregar_particao,
+    conhecido=dispositivo_conhecido,
+    max_eventos=int(os.environ.get('PARTICOES_MAX_EVENTOS', '1000000')),
+    max_particoes=int(os.environ.get('PARTICOES_MAX', '1000')),
+    ociosidade=float(os.environ.get('PARTICOES_OCIOSIDADE_SEGUNDOS', '600'))
+)
+
+# Métricas expostas em /metrics (por processo).
+METRICAS = MetricsRegistry()
+REQUISICOES = METRICAS.counter(
+    'cuida_requisicoes_total', 'Requisições atendidas, por rota, método e status.',
+    ('rota', 'metodo', 'status'))
+DURACAO_REQUISICAO = METRICAS.histogram(
+    'cuida_requisicao_segundos', 'Latência das requisições até o início da resposta, por rota.',
+    ('rota',))
+INGESTAO = METRICAS.histogram(
+    'cuida_ingestao_segundos', 'Gravação de um lote de eventos (DB, memória e log do snapshot).')
+TAMANHO_LOTE = METRICAS.histogram(
+    'cuida_ingestao_lote_eventos', 'Eventos por lote gravado (group commit).',
+    limites=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+EVENTOS_GRAVADOS = METRICAS.counter('cuida_eventos_gravados_total', 'Eventos gravados por este processo.')
+DB_COMMIT = METRICAS.histogram('cuida_db_commit_segundos', 'INSERTs e commit de um lote no DB.')
+INDICE_INSERCAO = METRICAS.histogram(
+    'cuida_indice_insercao_segundos', 'Mescla de um lote no índice, agregados e grade (sob o lock).')
+PERCURSO = METRICAS.histogram(
+    'cuida_indice_percurso_segundos', 'Cópia da faixa pedida em /api/eventos (sob o lock).')
+SERIALIZACAO = METRICAS.histogram(
+    'cuida_serializacao_segundos', 'Serialização JSON da resposta de /api/eventos.')
+ANALISE_RISCO = METRICAS.histogram(
+    'cuida_analise_risco_segundos', 'Análise de risco, por caminho (agregados ou histórico).',
+    ('caminho',))
+METRICAS.gauge('cuida_eventos_em_memoria', 'Eventos no índice global.', lambda: len(FALL_DATA_TREE))
+METRICAS.gauge('cuida_particoes_carregadas', 'Partições de dispositivo em memória.', lambda: len(PARTICOES))
+METRICAS.gauge('cuida_stream_inscritos', 'Clientes conectados a /api/eventos/stream.', lambda: len(BROADCASTER))
+METRICAS.gauge('cuida_logs_descartados_total', 'Logs descartados com a fila de log cheia.',
+               lambda: LOG_HANDLER.descartados, tipo='counter')
+
+# Perfil por requisição: PERFIL_MODO=cabecalho (com X-Perfil: 1) ou todas.
+PERFIL = RequestProfiler(
+    os.environ.get('PERFIL_MODO', ''),
+    os.environ.get('PERFIL_DIR', os.path.join(app.instance_path, 'perfis'))
+)
 
 # ------------------------------------------------------------------
 # PARTE 3: Rotas do Webservice
 # ------------------------------------------------------------------
 
+@app.before_request
+def iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+    g.perfil = PERFIL.iniciar() if PERFIL.deve_perfilar(request.headers) else None
+
+@app.after_request
+def registrar_medicao(response):
+    """Registra latência e status de cada requisição (e o perfil, se houver)."""
+    rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+    if 'inicio_requisicao' in g:
+        DURACAO_REQUISICAO.observe(time.perf_counter() - g.inicio_requisicao, rota=rota)
+    REQUISICOES.inc(rota=rota, metodo=request.method, status=response.status_code)
+
+    perfil = g.pop('perfil', None)
+    if perfil is not None:
+        nome, resumo = PERFIL.concluir(perfil, rota)
+        response.headers['X-Perfil'] = nome
+        log.info("Perfil de %s %s gravado em %s:\n%s", request.method, rota, nome, resumo)
+    return response
+
+@app.teardown_request
+def encerrar_perfil(erro):
+    # Se a requisição falhou antes do after_request, o perfil ainda está ativo.
+    perfil = g.pop('perfil', None)
+    if perfil is not None:
+        perfil.disable()
+
+@app.route('/metrics')
+def metrics():
+    """Métricas deste processo no formato texto do Prometheus."""
+    return Response(METRICAS.exportar(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     """Serve a página HTML do monitor."""
     return render_template('monitor.html')
 
+LIMITE_LOTE_EVENTOS = 1000
+# Tolerância para relógios de ESP32 levemente adiantados.
+TOLERANCIA_RELOGIO_SEGUNDOS = 300
+
+def validar_evento(data, agora, aceitar_timestamp=False):
+    """
+    Valida o JSON de um evento e devolve (registro, erro). O registro tem
+    as colunas de Evento; `timestamp` do dispositivo só é aceito no envio
+    em lote (eventos guardados no ESP32 enquanto estava offline).
+    """
+    if not isinstance(data, dict):
+        return None, "JSON inválido ou ausente"
+
+    event_type = data.get('tipo_evento')
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    aceleracao = data.get('aceleracao', 'N/A')
+    dispositivo = data.get('dispositivo') or DISPOSITIVO_PADRAO
+
+    if not all([event_type, latitude, longitude]):
+        return None, "Dados incompletos (tipo, lat, ou lon)"
+    # O índice guarda as coordenadas em arrays de float.
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None, "latitude/longitude inválidas"
+    if not (math.isfinite(latitude) and math.isfinite(longitude)
+            and -90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None, "latitude/longitude inválidas"
+    # Textos acima do tamanho da coluna: o Postgres recusaria o INSERT (e o
+    # SQLite gravaria um valor que não cabe no log do snapshot).
+    if not isinstance(event_type, str) or len(event_type) > CARACTERES_TEXTO['tipo']:
+        return None, "tipo_evento inválido"
+    # Números viram texto já aqui, como o DB devolveria a coluna depois.
+    if isinstance(aceleracao, (int, float)) and not isinstance(aceleracao, bool):
+        aceleracao = str(aceleracao)
+    if aceleracao is not None and (not isinstance(aceleracao, str)
+                                   or len(aceleracao) > CARACTERES_TEXTO['acel']):
+        return None, "aceleracao inválida"
+    if not isinstance(dispositivo, str) or len(dispositivo) > CARACTERES_TEXTO['dispositivo']:
+        return None, "dispositivo inválido"
+
+    timestamp_key = int(agora)
+    if aceitar_timestamp and data.get('timestamp') is not None:
+        timestamp_key = data['timestamp']
+        if (not isinstance(timestamp_key, int) or isinstance(timestamp_key, bool)
+                or not 0 < timestamp_key <= agora + TOLERANCIA_RELOGIO_SEGUNDOS):
+            return None, "timestamp inválido"
+
+    return {
+        "timestamp": timestamp_key,
+        "tipo": event_type,
+        "lat": latitude,
+        "lon": longitude,
+        "acel": aceleracao,
+        "dispositivo": dispositivo
+    }, None
+
+def entradas_de_linhas(linhas):
+    """Converte linhas (id, timestamp, tipo, lat, lon, acel, dispositivo) em (chave, payload)."""
+    return [
+        ((timestamp, evento_id),
+         {"tipo": tipo, "lat": lat, "lon": lon, "acel": acel, "dispositivo": dispositivo})
+        for evento_id, timestamp, tipo, lat, lon, acel, dispositivo in linhas
+    ]
+
+def aplicar_em_memoria(linhas):
+    """
+    Mescla linhas (id, timestamp, tipo, lat, lon, acel, dispositivo) no
+    índice, nos agregados e nas partições carregadas, ignorando as que já
+    estão lá (a mesma linha pode chegar pela gravação local e pelo feed).
+    Retorna os ids de todas as linhas.
+    """
+    with INDICE_LOCK:
+        inicio = time.perf_counter()
+        novas = [linha for linha in linhas if (linha[1], linha[0]) not in FALL_DATA_TREE]
+        entradas = entradas_de_linhas(novas)
+        FALL_DATA_TREE.merge(entradas)
+        GEO_INDEX.adicionar(novas)
+        for linha in novas:
+            RISK_AGGREGATES.add(linha[1], linha[2])
+        # Os clientes do stream recebem os eventos ao vivo por aqui; o que um
+        # cliente perder (fila cheia, reconexão) é relido do DB pelo id.
+        BROADCASTER.publish(entradas)
+        INDICE_INSERCAO.observe(time.perf_counter() - inicio)
+
+    por_dispositivo = {}
+    for chave, payload in entradas:
+        por_dispositivo.setdefault(payload["dispositivo"], []).append((chave, payload))
+    for dispositivo, entradas_dispositivo in por_dispositivo.items():
+        PARTICOES.aplicar(dispositivo, entradas_dispositivo)
+    return [linha[0] for linha in linhas]
+
+def buscar_eventos_novos(ultimo_id, lacunas, limite=None):
+    """
+    Consulta a cauda da tabela: ids acima de ultimo_id ou ainda pendentes,
+    em ordem de id (no máximo `limite` linhas).
+    """
+    filtro = Evento.id > ultimo_id
+    if lacunas:
+        filtro = or_(filtro, Evento.id.in_(lacunas))
+    consulta = (db.session.query(Evento.id, Evento.timestamp, Evento.tipo,
+                                 Evento.lat, Evento.lon, Evento.acel, Evento.dispositivo)
+                .filter(filtro).order_by(Evento.id))
+    if limite is not None:
+        consulta = consulta.limit(limite)
+    return consulta.all()
+
+def sincronizar_com_outros_workers(forcar=False):
+    """Aplica no índice local os eventos gravados por outros processos."""
+    EVENT_FEED.sincronizar(buscar_eventos_novos, aplicar_em_memoria, forcar=forcar)
+
+def gravar_lote(registros):
+    """
+    Grava os registros em uma única transação e só então os mescla no
+    índice e nos agregados em memória. Retorna os ids na mesma ordem.
+    Só levanta exceção se o commit falhou: depois dele, os erros são
+    registrados no log e os eventos seguem gravados.
+    """
+    inicio = time.perf_counter()
+    eventos = [Evento(**registro) for registro in registros]
+    with DB_COMMIT.time():
+        try:
+            db.session.add_all(eventos)
+            # O flush já devolve os ids gerados pelos INSERTs; lê-los antes do
+            # commit evita o SELECT extra que o ORM faria após expirar os objetos.
+            db.session.flush()
+            ids = [evento.id for evento in eventos]
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    linhas = [
+        (evento_id, registro["timestamp"], registro["tipo"], registro["lat"],
+         registro["lon"], registro["acel"], registro["dispositivo"])
+        for registro, evento_id in zip(registros, ids)
+    ]
+    try:
+        aplicar_em_memoria(linhas)
+        EVENT_FEED.registrar(ids)
+    except Exception:
+        # Sem registrar() os ids, o feed os relê do DB e tenta de novo.
+        log.exception("Lote gravado no DB, mas não aplicado em memória: Ids=%d..%d", ids[0], ids[-1])
+
+    if SNAPSHOT_ATIVO:
+        try:
+            EVENT_LOG.append(linhas)
+            if EVENT_LOG.quantidade() > SNAPSHOT_MAX_WAL:
+                compactar_em_segundo_plano()
+        except Exception as e:
+            # O log só acelera a inicialização; o DB já tem o evento.
+            log.warning("Evento não registrado no log do snapshot: %s", e)
+
+    INGESTAO.observe(time.perf_counter() - inicio)
+    TAMANHO_LOTE.observe(len(ids))
+    EVENTOS_GRAVADOS.inc(len(ids))
+    log.debug("Lote armazenado (DB e ABB): %d evento(s), Ids=%d..%d", len(ids), ids[0], ids[-1])
+    return ids
+
+GROUP_COMMIT = GroupCommitWriter(
+    app,
+    gravar_lote,
+    janela_ms=float(os.environ.get('GROUP_COMMIT_JANELA_MS', '5')),
+    max_lote=int(os.environ.get('GROUP_COMMIT_MAX_LOTE', '500'))
+)
+
 @app.route('/api/reportar_evento', methods=['POST'])
 def report_event():
     """Endpoint para o ESP32 enviar dados."""
     try:
-        data = request.get_json() 
-        if data is None:
-            return jsonify({"status": "erro", "mensagem": "JSON inválido ou ausente"}), 400
-        
-        event_type = data.get('tipo_evento')
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        aceleracao = data.get('aceleracao', 'N/A')
-        
-        if not all([event_type, latitude, longitude]):
-            return jsonify({"status": "erro", "mensagem": "Dados incompletos (tipo, lat, ou lon)"}), 400
+        data = request.get_json(silent=True)
+        registro, erro = validar_evento(data, time.time())
+        if erro:
+            return jsonify({"status": "erro", "mensagem": erro}), 400
 
-        timestamp_key = int(time.time()) 
-        
-        payload = {
-            "tipo": event_type,
-            "lat": latitude,
-            "lon": longitude,
-            "acel": aceleracao
-        }
-
-        novo_evento_db = Evento(
-            timestamp=timestamp_key,
-            tipo=event_type,
-            lat=latitude,
-            lon=longitude,
-            acel=aceleracao
-        )
-        db.session.add(novo_evento_db)
-        db.session.commit()
-        
-        FALL_DATA_TREE.insert(timestamp_key, payload)
-        
-        print(f"Evento armazenado (DB e ABB): Tipo={event_type}, Chave={timestamp_key}")
+        # Requisições concorrentes são gravadas juntas pela thread de group
+        # commit; com GROUP_COMMIT_JANELA_MS=0, grava direto como antes.
+        # Se o registro esperar demais na fila, ele é retirado sem ser gravado
+        # e o cliente pode reenviar sem duplicar.
+        if GROUP_COMMIT.ativo:
+            try:
+                evento_id = GROUP_COMMIT.gravar(registro, timeout=30)
+            except TimeoutError:
+                return jsonify({"status": "erro", "mensagem": "Servidor ocupado: evento não gravado, tente novamente"}), 503
+        else:
+            evento_id = gravar_lote([registro])[0]
         
-        return jsonify({"status": "sucesso", "chave_registro": timestamp_key}), 200
+        return jsonify({"status": "sucesso", "chave_registro": registro["timestamp"], "id": evento_id}), 200
 
     except Exception as e:
-        db.session.rollback() 
-        print(f"Erro ao processar requisição: {e}")
+        log.exception("Erro ao processar requisição")
         return jsonify({"status": "erro", "mensagem": f"Erro interno: {str(e)}"}), 500
 
+@app.route('/api/reportar_eventos', methods=['POST'])
+def report_events():
+    """
+    Endpoint para o ESP32 enviar vários eventos de uma vez (por exemplo, os
+    guardados enquanto estava sem conexão). Aceita uma lista de eventos, ou
+    {"dispositivo": ..., "eventos": [...]}, cada um podendo trazer seu
+    próprio `timestamp` (e `dispositivo`, se não vier no envelope).
+    O lote é gravado inteiro ou rejeitado inteiro.
+    """
+    try:
+        data = request.get_json(silent=True)
+        dispositivo_lote = None
+        if isinstance(data, dict):
+            dispositivo_lote = data.get('dispositivo')
+            data = data.get('eventos')
+        if not isinstance(data, list) or not data:
+            return jsonify({"status": "erro", "mensagem": "Lista de eventos inválida ou ausente"}), 400
+        if len(data) > LIMITE_LOTE_EVENTOS:
+            return jsonify({"status": "erro", "mensagem": f"Máximo de {LIMITE_LOTE_EVENTOS} eventos por lote"}), 400
+
+        agora = time.time()
+        registros = []
+        for posicao, item in enumerate(data):
+            if dispositivo_lote and isinstance(item, dict) and 'dispositivo' not in item:
+                item = dict(item, dispositivo=dispositivo_lote)
+            registro, erro = validar_evento(item, agora, aceitar_timestamp=True)
+            if erro:
+                return jsonify({"status": "erro", "mensagem": f"Evento {posicao}: {erro}"}), 400
+            registros.append(registro)
+
+        ids = gravar_lote(registros)
+        return jsonify({"status": "sucesso", "total": len(ids), "ids": ids}), 200
+
+    except Exception as e:
+        log.exception("Erro ao processar lote")
+        return jsonify({"status": "erro", "mensagem": f"Erro interno: {str(e)}"}), 500
+
+LIMITE_MAXIMO_EVENTOS = 1000
+
+def serializar_evento(chave, data):
+    """Converte uma entrada do índice no formato JSON da API."""
+    timestamp, evento_id = chave
+    return {"key": timestamp, "id": evento_id, "data": data}
+
+def codificar_cursor(chave):
+    """Gera o cursor opaco que o cliente devolve para continuar a leitura."""
+    bruto = json.dumps(chave, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip('=')
+
+def decodificar_cursor(cursor):
+    """Recupera a chave de um cursor gerado por codificar_cursor()."""
+    preenchido = cursor + '=' * (-len(cursor) % 4)
+    chave = json.loads(base64.urlsafe_b64decode(preenchido.encode()))
+    if (not isinstance(chave, list) or len(chave) != 2
+            or not all(isinstance(parte, int) for parte in chave)):
+        raise ValueError("cursor inválido")
+    return tuple(chave)
+
+# Acima disso, a posição vira só "ultimo_id = menor lacuna - 1": o cliente
+# recebe alguns eventos de novo (e os descarta pelo id), mas nenhum se perde.
+LIMITE_LACUNAS_POSICAO = 100
+
+# Maior id que o DB (e o índice, em int64) aceita; acima disso a consulta estoura.
+ID_MAXIMO = 2**63 - 1
+
+def codificar_posicao(ultimo_id, lacunas):
+    """
+    Posição de leitura por id do DB (ver EventChangeFeed): tudo até
+    ultimo_id, exceto as lacunas, já foi entregue. Ao contrário do cursor
+    (timestamp, id), só anda para frente: eventos gravados depois com um
+    timestamp antigo (lotes do ESP32, outros workers) continuam à frente dela.
+    """
+    if len(lacunas) > LIMITE_LACUNAS_POSICAO:
+        ultimo_id, lacunas = min(lacunas) - 1, []
+    return codificar_cursor([ultimo_id, *lacunas])
+
+def decodificar_posicao(posicao):
+    """Recupera (ultimo_id, lacunas) de codificar_posicao()."""
+    preenchido = posicao + '=' * (-len(posicao) % 4)
+    partes = json.loads(base64.urlsafe_b64decode(preenchido.encode()))
+    if (not isinstance(partes, list) or not partes
+            or len(partes) > LIMITE_LACUNAS_POSICAO + 1
+            or not all(isinstance(parte, int) and 0 <= parte <= ID_MAXIMO for parte in partes)):
+        raise ValueError("posição inválida")
+    return partes[0], partes[1:]
+
+def posicao_do_cliente(posicao=None):
+    """EventChangeFeed com o que já foi entregue a um cliente (vazio sem posição)."""
+    entregues = EventChangeFeed()
+    if posicao:
+        entregues.inicializar(*decodificar_posicao(posicao))
+    return entregues
+
+def ler_desde(entregues, limite):
+    """
+    Lê do DB, em ordem de id, até `limite` eventos ainda não entregues e os
+    registra em `entregues`. Retorna (entradas, tem_mais).
+    """
+    ultimo_id, lacunas = entregues.posicao()
+    linhas = buscar_eventos_novos(ultimo_id, lacunas, limite=limite)
+    # Não segura uma conexão do pool entre as leituras.
+    db.session.close()
+    entregues.registrar([linha[0] for linha in linhas])
+    return entradas_de_linhas(linhas), len(linhas) == limite
+
 @app.route('/api/eventos', methods=['GET'])
 def get_events():
-    """Endpoint para o dashboard (lê da Árvore/cache)."""
-    events = FALL_DATA_TREE.get_all_events_sorted()
-    return jsonify(eventos=events, total=len(events)), 200
+    """
+    Endpoint para o dashboard (lê do índice em memória).
+
+    Parâmetros opcionais (query string):
+      since / until -> intervalo de timestamps (inclusivo, em segundos)
+      limit         -> máximo de eventos por resposta (até LIMITE_MAXIMO_EVENTOS)
+      cursor        -> devolve apenas eventos posteriores ao cursor recebido
+      dispositivo   -> restringe a um dispositivo/paciente (usa a partição dele)
+    Sem parâmetros, devolve todos os eventos, como antes.
+
+    A resposta traz também `posicao`: o ponto (por id do DB) a partir do
+    qual /api/eventos/stream ou /api/eventos/novos continuam. Ela é tirada
+    antes da cópia, então quem lê todas as páginas e segue pela posição da
+    primeira não perde nenhum evento, só pode recebê-lo de novo.
+    """
+    try:
+        since = request.args.get('since', type=int)
+        until = request.args.get('until', type=int)
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        if limit is not None and not 0 < limit <= LIMITE_MAXIMO_EVENTOS:
+            raise ValueError(f"limit deve estar entre 1 e {LIMITE_MAXIMO_EVENTOS}")
+        chave_cursor = decodificar_cursor(cursor) if cursor else None
+        dispositivo = request.args.get('dispositivo')
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "erro", "mensagem": f"Parâmetros inválidos: {e}"}), 400
+
+    # (ts,) precede qualquer (ts, id) e (ts, inf) sucede todos do mesmo segundo.
+    inicio = (since,) if since is not None else None
+    fim = (until, float('inf')) if until is not None else None
+    exclusivo = False
+    if chave_cursor is not None and (inicio is None or chave_cursor >= inicio):
+        inicio, exclusivo = chave_cursor, True
+
+    sincronizar_com_outros_workers()
+    if dispositivo:
+        particao = PARTICOES.obter(dispositivo)
+        indice, lock = particao.indice, particao.lock
+    else:
+        indice, lock = FALL_DATA_TREE, INDICE_LOCK
+    with lock:
+        # O feed só registra ids depois de aplicá-los, então tudo o que a
+        # posição cobre já está no índice.
+        posicao = codificar_posicao(*EVENT_FEED.posicao())
+        # Copia só as colunas da faixa; a serialização acontece fora do lock.
+        with PERCURSO.time():
+            colunas, tem_mais = indice.slice_columns(inicio, fim, exclusive_min=exclusivo, limit=limit)
+
+    if len(colunas):
+        proximo_cursor = codificar_cursor(list(colunas.chave(-1)))
+    else:
+        proximo_cursor = cursor
+
+    def corpo():
+        # Mesmo JSON que jsonify(eventos=..., total=..., ...) produzia, escrito
+        # em partes direto das colunas. O tempo conta só a serialização, não
+        # a espera pelo cliente entre as partes.
+        gasto = 0.0
+        inicio_parte = time.perf_counter()
+        yield '{"eventos":['
+        for parte in eventos_json(colunas, indice.textos):
+            gasto += time.perf_counter() - inicio_parte
+            yield parte
+            inicio_parte = time.perf_counter()
+        yield (f'],"posicao":{json.dumps(posicao)},"proximo_cursor":{json.dumps(proximo_cursor)},'
+               f'"tem_mais":{json.dumps(tem_mais)},"total":{len(colunas)}}}\n')
+        SERIALIZACAO.observe(gasto + time.perf_counter() - inicio_parte)
+
+    return Response(corpo(), mimetype='application/json'), 200
+
+STREAM_PAGINA = 500
+STREAM_HEARTBEAT_SEGUNDOS = 15
+
+def mensagens_sse(entradas, posicao):
+    """
+    Formata entradas do índice como mensagens Server-Sent Events. Só a
+    última leva `id:` (a posição depois do lote inteiro), que o navegador
+    devolve em Last-Event-ID ao reconectar.
+    """
+    partes = [
+        f"event: evento\n"
+        f"data: {json.dumps(serializar_evento(chave, data), separators=(',', ':'))}\n\n"
+        for chave, data in entradas
+    ]
+    partes[-1] = f"id: {posicao}\n" + partes[-1]
+    return "".join(partes)
+
+@app.route('/api/eventos/stream', methods=['GET'])
+def stream_events():
+    """
+    Stream (Server-Sent Events) dos eventos novos, substituindo o polling.
+    Retoma da posição recebida em ?posicao= (a de /api/eventos) ou no
+    cabeçalho Last-Event-ID (enviado pelo navegador ao reconectar); sem
+    posição, envia todo o histórico, em ordem de id, antes de seguir ao vivo.
+
+    A posição é por id do DB, não pela chave (timestamp, id): um cliente
+    que estoura a fila, ou reconecta, relê do DB tudo o que ainda não
+    recebeu, inclusive eventos com timestamp antigo gravados depois. Um
+    evento pode chegar repetido (o dashboard descarta pelo id), nunca faltar.
+    """
+    posicao = request.headers.get('Last-Event-ID') or request.args.get('posicao')
+    try:
+        entregues = posicao_do_cliente(posicao)
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "erro", "mensagem": f"Parâmetros inválidos: {e}"}), 400
+
+    def gerar():
+        inscrito = BROADCASTER.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            relendo = True
+            ultimo_envio = time.monotonic()
+            while True:
+                if relendo:
+                    # Volta a enfileirar os eventos ao vivo antes de consultar o
+                    # DB: o que for aplicado durante a leitura fica na fila.
+                    inscrito.reiniciar()
+                    entradas, relendo = ler_desde(entregues, STREAM_PAGINA)
+                else:
+                    sincronizar_com_outros_workers()
+                    # Não segura uma conexão do pool durante todo o stream.
+                    db.session.close()
+                    entradas, relendo = inscrito.aguardar(timeout=1.0)
+                    if relendo:
+                        continue
+                    entradas = [(chave, data) for chave, data in entradas
+                                if not entregues.aplicado(chave[1])]
+                    entregues.registrar([chave[1] for chave, _ in entradas])
+
+                if entradas:
+                    ultimo_envio = time.monotonic()
+                    yield mensagens_sse(entradas, codificar_posicao(*entregues.posicao()))
+                elif time.monotonic() - ultimo_envio >= STREAM_HEARTBEAT_SEGUNDOS:
+                    ultimo_envio = time.monotonic()
+                    yield ": ping\n\n"
+        finally:
+            BROADCASTER.unsubscribe(inscrito)
+
+    return Response(
+        stream_with_context(gerar()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/api/eventos/novos', methods=['GET'])
+def eventos_novos():
+    """
+    Alternativa ao stream para clientes sem EventSource: devolve, em ordem
+    de id, até `limit` eventos gravados depois de ?posicao= e a posição
+    para a próxima chamada.
+    """
+    try:
+        limit = _limite_eventos()
+        entregues = posicao_do_cliente(request.args.get('posicao'))
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "erro", "mensagem": f"Parâmetros inválidos: {e}"}), 400
+
+    entradas, tem_mais = ler_desde(entregues, limit)
+    return jsonify(
+        eventos=[serializar_evento(chave, data) for chave, data in entradas],
+        posicao=codificar_posicao(*entregues.posicao()),
+        tem_mais=tem_mais
+    ), 200
 
 # ------------------------------------------------------------------
 # --- INÍCIO DAS NOVAS ROTAS (PÁGINA DE DADOS E "IA") ---
@@ -155,118 +700,457 @@ def pagina_dados():
 def analise_de_risco():
     """
     Este é o nosso "Algoritmo de IA".
-    Ele lê do Banco de Dados e aplica regras de heurística.
+    Aplica regras de heurística sobre os agregados mantidos em memória
+    (RISK_AGGREGATES), sem varrer o Banco de Dados a cada requisição.
+    Com ?dispositivo=, usa só os agregados da partição daquele paciente.
+    Com ?verificar=1, refaz a contagem completa no DB e compara.
     """
-    print("Iniciando análise de risco algorítmica...")
+    log.debug("Iniciando análise de risco algorítmica...")
     try:
-        fuso_horario_br = pytz.timezone('America/Sao_Paulo')
-        
-        HORA_INICIO_NOITE = 22
-        HORA_FIM_NOITE = 6
-        
-        agora = datetime.now(fuso_horario_br)
-        uma_semana_atras = agora - timedelta(days=7)
-        timestamp_uma_semana_atras = int(uma_semana_atras.timestamp())
+        sincronizar_com_outros_workers()
+        dispositivo = request.args.get('dispositivo')
+        with ANALISE_RISCO.time(caminho='agregados'):
+            agora = time.time()
+            if dispositivo:
+                # O lock da partição fica preso enquanto outra requisição
+                # ainda a carrega; sem ele, leríamos agregados incompletos.
+                particao = PARTICOES.obter(dispositivo)
+                with particao.lock:
+                    contagens = particao.agregados.snapshot(agora)
+            else:
+                contagens = RISK_AGGREGATES.snapshot(agora)
+            lista_de_alertas = gerar_alertas(contagens)
+        resposta = {"alertas": lista_de_alertas}
 
-        eventos_do_db = Evento.query.all()
+        if request.args.get('verificar') == '1':
+            with ANALISE_RISCO.time(caminho='verificacao'):
+                consulta = db.session.query(Evento.timestamp, Evento.tipo)
+                if dispositivo:
+                    consulta = consulta.filter(Evento.dispositivo == dispositivo)
+                linhas = consulta.yield_per(10000)
+                completas = contagens_por_varredura(linhas, agora)
+            resposta["consistente"] = completas == contagens
+            if not resposta["consistente"]:
+                log.warning("Agregados divergem da varredura completa: %s != %s", contagens, completas)
+                resposta["contagens"] = contagens
+                resposta["contagens_varredura"] = completas
         
-        if not eventos_do_db:
-            return jsonify({"alertas": ["Não há dados suficientes para análise."]})
+        log.debug("Análise de risco concluída. %d alertas gerados.", len(lista_de_alertas))
+        return jsonify(resposta)
 
-        total_eventos = len(eventos_do_db)
-        eventos_noturnos = 0
-        eventos_recentes = 0
-        total_quedas = 0
-        total_panicos = 0
+    except Exception as e:
+        log.exception("Erro na análise de risco")
+        return jsonify({"erro": str(e)}), 500
 
-        for evento in eventos_do_db:
-            ts_evento = datetime.fromtimestamp(evento.timestamp, fuso_horario_br)
-            
-            if ts_evento.hour >= HORA_INICIO_NOITE or ts_evento.hour < HORA_FIM_NOITE:
-                eventos_noturnos += 1
-            
-            if evento.timestamp >= timestamp_uma_semana_atras:
-                eventos_recentes += 1
-            
-            if evento.tipo == 'queda':
-                total_quedas += 1
-            elif evento.tipo == 'panico':
-                total_panicos += 1
-
-        lista_de_alertas = []
-
-        if eventos_noturnos > 0:
-            alerta = (
-                f"Detectamos {eventos_noturnos} evento(s) "
-                f"ocorrendo durante a noite (22h-06h). "
-                "Isso pode indicar confusão noturna (sundowning) ou risco de queda no escuro."
-            )
-            lista_de_alertas.append({"nivel": "alto", "texto": alerta})
-        
-        if eventos_recentes > 2:
-            alerta = (
-                f"A frequência de eventos aumentou, "
-                f"com {eventos_recentes} alertas registrados apenas nos últimos 7 dias. "
-                "Recomenda-se observação."
-            )
-            lista_de_alertas.append({"nivel": "medio", "texto": alerta})
-        elif eventos_recentes > 0:
-            alerta = (
-                f"{eventos_recentes} evento(s) "
-                f"registrado(s) nos últimos 7 dias."
-            )
-            lista_de_alertas.append({"nivel": "info", "texto": alerta})
-
-        if total_quedas > total_panicos and total_quedas > 0:
-            alerta = (
-                f"O paciente registrou mais quedas ({total_quedas}) "
-                f"do que botões de pânico ({total_panicos}). "
-                "Isso pode indicar uma dificuldade de locomoção."
-            )
-            lista_de_alertas.append({"nivel": "info", "texto": alerta})
-
-        if not lista_de_alertas:
-            lista_de_alertas.append({
-                "nivel": "info", 
-                "texto": "Nenhum padrão de risco óbvio detectado nos dados atuais. Continue monitorando."
-            })
-        
-        print(f"✅ Análise de risco concluída. {len(lista_de_alertas)} alertas gerados.")
-        return jsonify(alertas=lista_de_alertas)
+@app.route('/api/analise_de_risco/historico', methods=['GET'])
+def analise_de_risco_historico():
+    """
+    Relatório de janelas longas pelo caminho colunar (NumPy).
+    ?dias=30|90|365 (ou qualquer inteiro positivo) limita a janela; sem o
+    parâmetro, analisa todo o histórico e gera os mesmos alertas de
+    /api/analise_de_risco. Inclui o histograma de eventos por hora.
+    ?dispositivo= restringe a um paciente.
+    """
+    try:
+        dias = request.args.get('dias', type=int)
+        dispositivo = request.args.get('dispositivo')
+        if dias is not None and dias <= 0:
+            return jsonify({"status": "erro", "mensagem": "dias deve ser positivo"}), 400
+
+        agora = time.time()
+        inicio = (int(agora - dias * 86400),) if dias is not None else None
+
+        sincronizar_com_outros_workers()
+        with ANALISE_RISCO.time(caminho='historico'):
+            # Lê as colunas tipadas do índice em memória (o mesmo conteúdo do
+            # DB) em vez de montar uma linha do ORM por evento.
+            with INDICE_LOCK:
+                copia = FALL_DATA_TREE.column_arrays(("ts", "tipo", "dispositivo"), inicio)
+                textos = FALL_DATA_TREE.textos
+                codigo = textos.existente(dispositivo) if dispositivo else None
+            if dispositivo and codigo is None:
+                copia = {nome: coluna[:0] for nome, coluna in copia.items()}
+            colunas = carregar_colunas(copia, textos.textos, codigo)
+            contagens, histograma = analisar_colunas(colunas, agora, dias)
+        return jsonify(
+            alertas=gerar_alertas(contagens),
+            contagens=contagens,
+            histograma_por_hora=histograma,
+            janela_dias=dias
+        )
 
     except Exception as e:
-        print(f"Erro na análise de risco: {e}")
+        log.exception("Erro na análise de risco histórica")
         return jsonify({"erro": str(e)}), 500
 
+# ------------------------------------------------------------------
+# --- CONSULTAS ESPACIAIS (ONDE AS QUEDAS SE CONCENTRAM) ---
+# ------------------------------------------------------------------
+
+RAIO_PADRAO_METROS = 200
+RAIO_MAXIMO_METROS = 50_000
+AGRUPAMENTO_PADRAO_GRAUS = 0.01
+LIMITE_AGRUPAMENTOS = 100
+
+def _filtros_espaciais():
+    """
+    Filtros comuns às consultas espaciais: since/until (timestamps) ou
+    dias (últimos N dias), tipo e dispositivo.
+    """
+    since = request.args.get('since', type=int)
+    until = request.args.get('until', type=int)
+    dias = request.args.get('dias', type=int)
+    if dias is not None:
+        if dias <= 0:
+            raise ValueError("dias deve ser positivo")
+        since = max(since or 0, int(time.time() - dias * 86400))
+    return {"since": since, "until": until,
+            "tipo": request.args.get('tipo'), "dispositivo": request.args.get('dispositivo')}
+
+def _coordenada(nome, limite):
+    valor = request.args.get(nome, type=float)
+    if valor is None or not -limite <= valor <= limite:
+        raise ValueError(f"{nome} ausente ou fora de [-{limite}, {limite}]")
+    return valor
+
+def _limite_eventos():
+    limit = request.args.get('limit', default=LIMITE_MAXIMO_EVENTOS, type=int)
+    if not 0 < limit <= LIMITE_MAXIMO_EVENTOS:
+        raise ValueError(f"limit deve estar entre 1 e {LIMITE_MAXIMO_EVENTOS}")
+    return limit
+
+def _caixa_da_requisicao(obrigatoria):
+    nomes = ('lat_min', 'lat_max', 'lon_min', 'lon_max')
+    if not obrigatoria and not any(nome in request.args for nome in nomes):
+        return {}
+    caixa = {nome: _coordenada(nome, 90 if nome.startswith('lat') else 180) for nome in nomes}
+    if caixa['lat_min'] > caixa['lat_max'] or caixa['lon_min'] > caixa['lon_max']:
+        raise ValueError("lat_min/lon_min devem ser menores que lat_max/lon_max")
+    return caixa
+
+def serializar_da_grade(eventos, limit, distancias=None):
+    """Converte as colunas devolvidas pelo GEO_INDEX no formato de /api/eventos."""
+    textos = GEO_INDEX.textos.textos
+    colunas = zip(eventos["ts"][:limit].tolist(), eventos["ids"][:limit].tolist(),
+                  eventos["tipo"][:limit].tolist(), eventos["lat"][:limit].tolist(),
+                  eventos["lon"][:limit].tolist(), eventos["acel"][:limit].tolist(),
+                  eventos["acel_formato"][:limit].tolist(), eventos["dispositivo"][:limit].tolist())
+    resultado = [
+        serializar_evento((timestamp, evento_id),
+                          {"tipo": textos[tipo], "lat": lat, "lon": lon,
+                           "acel": texto_acel(acel, acel_formato, textos),
+                           "dispositivo": textos[dispositivo]})
+        for timestamp, evento_id, tipo, lat, lon, acel, acel_formato, dispositivo in colunas
+    ]
+    if distancias is not None:
+        for evento, distancia in zip(resultado, distancias[:limit].tolist()):
+            evento["distancia_m"] = round(distancia, 1)
+    return resultado
+
+@app.route('/api/eventos/proximos', methods=['GET'])
+def eventos_proximos():
+    """
+    Eventos a até ?raio= metros (padrão RAIO_PADRAO_METROS) de ?lat=&lon=,
+    do mais próximo ao mais distante, com a distância em metros.
+    Filtros opcionais: since/until ou dias, tipo, dispositivo, limit.
+    """
+    try:
+        lat, lon = _coordenada('lat', 90), _coordenada('lon', 180)
+        raio = request.args.get('raio', default=RAIO_PADRAO_METROS, type=float)
+        if not 0 < raio <= RAIO_MAXIMO_METROS:
+            raise ValueError(f"raio deve estar entre 0 e {RAIO_MAXIMO_METROS} metros")
+        limit = _limite_eventos()
+        filtros = _filtros_espaciais()
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "erro", "mensagem": f"Parâmetros inválidos: {e}"}), 400
+
+    sincronizar_com_outros_workers()
+    eventos, distancias = GEO_INDEX.raio(lat, lon, raio, **filtros)
+    return jsonify(
+        eventos=serializar_da_grade(eventos, limit, distancias),
+        total=len(distancias),
+        tem_mais=len(distancias) > limit
+    ), 200
+
+@app.route('/api/eventos/area', methods=['GET'])
+def eventos_na_area():
+    """
+    Eventos dentro do retângulo ?lat_min=&lat_max=&lon_min=&lon_max=, em
+    ordem cronológica. Filtros opcionais: since/until ou dias, tipo,
+    dispositivo, limit.
+    """
+    try:
+        caixa = _caixa_da_requisicao(obrigatoria=True)
+        limit = _limite_eventos()
+        filtros = _filtros_espaciais()
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "erro", "mensagem": f"Parâmetros inválidos: {e}"}), 400
+
+    sincronizar_com_outros_workers()
+    eventos = GEO_INDEX.caixa(**caixa, **filtros)
+    total = len(eventos["ts"])
+    return jsonify(
+        eventos=serializar_da_grade(eventos, limit),
+        total=total,
+        tem_mais=total > limit
+    ), 200
+
+@app.route('/api/eventos/agrupamentos', methods=['GET'])
+def eventos_agrupados():
+    """
+    Pontos de concentração: conta os eventos por célula de ?tamanho= graus
+    (padrão AGRUPAMENTO_PADRAO_GRAUS, ~1 km) e devolve as células com mais
+    eventos, com o centro de massa de cada uma. Ex.: quedas dos últimos
+    30 dias -> ?tipo=queda&dias=30. Aceita também o retângulo de
+    /api/eventos/area, ?minimo= (eventos por célula) e ?limit=.
+    """
+    try:
+        tamanho = request.args.get('tamanho', default=AGRUPAMENTO_PADRAO_GRAUS, type=float)
+        if not 0.0001 <= tamanho <= 10:
+            raise ValueError("tamanho deve estar entre 0.0001 e 10 graus")
+        minimo = request.args.get('minimo', default=1, type=int)
+        limit = request.args.get('limit', default=LIMITE_AGRUPAMENTOS, type=int)
+        if not 0 < limit <= LIMITE_MAXIMO_EVENTOS:
+            raise ValueError(f"limit deve estar entre 1 e {LIMITE_MAXIMO_EVENTOS}")
+        caixa = _caixa_da_requisicao(obrigatoria=False)
+        filtros = _filtros_espaciais()
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "erro", "mensagem": f"Parâmetros inválidos: {e}"}), 400
+
+    sincronizar_com_outros_workers()
+    grupos = [grupo for grupo in GEO_INDEX.agrupar(tamanho, **caixa, **filtros)
+              if grupo[2] >= minimo]
+    return jsonify(
+        agrupamentos=[
+            {"total": total, "lat": lat_media, "lon": lon_media,
+             "celula": {"lat_min": i * tamanho, "lat_max": (i + 1) * tamanho,
+                        "lon_min": j * tamanho, "lon_max": (j + 1) * tamanho}}
+            for i, j, total, lat_media, lon_media in grupos[:limit]
+        ],
+        total_agrupamentos=len(grupos),
+        total_eventos=sum(grupo[2] for grupo in grupos),
+        tamanho_graus=tamanho
+    ), 200
+
 # ------------------------------------------------------------------
 # PARTE 4: Inicialização do Servidor
 # ------------------------------------------------------------------
 
+def _confere_com_db(ids, timestamps):
+    """
+    Confere o evento de maior id com a linha correspondente no DB, para
+    detectar arquivos de um banco recriado do zero.
+    """
+    if not len(ids):
+        return True
+    topo = ids.argmax()
+    timestamp_db = db.session.query(Evento.timestamp).filter(Evento.id == int(ids[topo])).scalar()
+    return timestamp_db == int(timestamps[topo])
+
+def carregar_do_snapshot():
+    """
+    Carrega o índice do snapshot e reaplica o log. Retorna False se não
+    houver snapshot válido para este DB (a carga então vem do DB).
+    """
+    lido = ler_snapshot(SNAPSHOT_PATH)
+    if lido is None:
+        return False
+    colunas, textos, ultimo_id = lido
+    tabela = StringTable(textos)
+    if len(tabela) != len(textos):
+        log.warning("Tabela de textos do snapshot inválida; ignorando.")
+        return False
+
+    # O snapshot e o log precisam bater com o DB atual.
+    if not _confere_com_db(colunas["ids"], colunas["ts"]):
+        log.warning("Snapshot não corresponde ao DB atual; ignorando.")
+        return False
+
+    eventos_log = EVENT_LOG.ler()
+    eventos_log = eventos_log[eventos_log["id"] > ultimo_id]
+    if not _confere_com_db(eventos_log["id"], eventos_log["timestamp"]):
+        log.warning("Log do snapshot não corresponde ao DB atual; descartando o log.")
+        EVENT_LOG.truncar()
+        eventos_log = eventos_log[:0]
+    _, unicos = np.unique(eventos_log["id"], return_index=True)
+    eventos_log = eventos_log[unicos]
+    # Eventos já aplicados, mas ainda não registrados no feed durante a
+    # compactação, estão no snapshot com id acima de ultimo_id.
+    eventos_log = eventos_log[~np.isin(eventos_log["id"], colunas["ids"][colunas["ids"] > ultimo_id])]
+
+    # Ids entre o snapshot e o fim do log que faltam no log (escritas de
+    # outro worker perdidas na compactação, por exemplo) viram lacunas do
+    # feed; se forem muitas, o log é descartado e o feed lê a cauda do DB.
+    if len(eventos_log):
+        faltantes = int(eventos_log["id"].max()) - ultimo_id - len(eventos_log)
+        if faltantes > EVENT_FEED.MAX_LACUNAS:
+            eventos_log = eventos_log[:0]
+
+    quantidade_snapshot = len(colunas["ts"])
+    if len(eventos_log):
+        do_log = colunas_de_registros(eventos_log, tabela)
+        ordem = np.lexsort((do_log["ids"], do_log["ts"]))
+        do_log = {nome: coluna[ordem] for nome, coluna in do_log.items()}
+        depois_do_snapshot = not quantidade_snapshot or (
+            (int(do_log["ts"][0]), int(do_log["ids"][0]))
+            > (int(colunas["ts"][-1]), int(colunas["ids"][-1])))
+        colunas = {nome: np.concatenate((colunas[nome], do_log[nome])) for nome in colunas}
+        if not depois_do_snapshot:
+            # O log tem eventos mais antigos que o fim do snapshot (lotes com
+            # timestamp do dispositivo): intercala as duas partes ordenadas.
+            # A ordenação estável pelo timestamp é só uma fusão de duas
+            # sequências; a lexsort completa fica para o caso raro de ids
+            # fora de ordem dentro do mesmo segundo.
+            ordem = np.argsort(colunas["ts"], kind="stable")
+            ts, ids = colunas["ts"][ordem], colunas["ids"][ordem]
+            if np.any((ts[1:] == ts[:-1]) & (ids[1:] < ids[:-1])):
+                ordem = np.lexsort((colunas["ids"], colunas["ts"]))
+            colunas = {nome: coluna[ordem] for nome, coluna in colunas.items()}
+    FALL_DATA_TREE.load_columns(colunas, tabela)
+
+    if len(colunas["ts"]):
+        rotulos = rotulos_de_tipo(tabela.textos)
+        semear_agregados(RISK_AGGREGATES, colunas["ts"], rotulos[colunas["tipo"]], time.time())
+
+    ids = colunas["ids"]
+    topo = int(ids.max()) if len(ids) else 0
+    inicio_lacunas = max(0, topo - EVENT_FEED.MAX_LACUNAS)
+    lacunas = np.setdiff1d(np.arange(inicio_lacunas + 1, topo + 1), ids[ids > inicio_lacunas])
+    EVENT_FEED.inicializar(topo, lacunas.tolist())
+
+    log.info("%d eventos do snapshot e %d do log carregados para a memória.",
+             quantidade_snapshot, len(eventos_log))
+    return True
+
+# Uma compactação por vez neste processo (EVENT_LOG.exclusivo cobre os outros).
+COMPACTACAO_LOCK = threading.Lock()
+
+def compactar_snapshot(se_log_maior_que=None):
+    """
+    Regrava o snapshot com o estado atual do índice e descarta o log que ele
+    cobre. Com `se_log_maior_que`, desiste se outro processo já compactou e
+    o log voltou a ficar pequeno. Retorna False se não compactou.
+    """
+    if not COMPACTACAO_LOCK.acquire(blocking=False):
+        return False
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with EVENT_LOG.exclusivo() as travado:
+            if not travado:
+                return False
+            if se_log_maior_que is not None and EVENT_LOG.quantidade() <= se_log_maior_que:
+                return False
+            with INDICE_LOCK:
+                colunas, _ = FALL_DATA_TREE.slice_columns()
+                # A tabela só cresce: a cópia da lista cobre todos os códigos copiados.
+                textos = list(FALL_DATA_TREE.textos.textos)
+                ultimo_id = EVENT_FEED.ultimo_id
+                # Lotes aplicados depois da cópia vão para um log novo; os de
+                # antes que ainda forem escritos nele só se repetem, e a carga
+                # descarta os ids que o snapshot já tem.
+                EVENT_LOG.rotacionar()
+            gravar_snapshot(SNAPSHOT_PATH, colunas, textos, ultimo_id)
+            EVENT_LOG.descartar_anterior()
+        log.info("Snapshot gravado com %d eventos.", len(colunas))
+        return True
+    finally:
+        COMPACTACAO_LOCK.release()
+
+def _compactar_com_log():
+    try:
+        compactar_snapshot(se_log_maior_que=SNAPSHOT_MAX_WAL)
+    except Exception:
+        log.exception("Erro ao gravar o snapshot")
+
+def compactar_em_segundo_plano():
+    """Compacta em uma thread própria, fora do caminho da ingestão."""
+    if not COMPACTACAO_LOCK.locked():
+        threading.Thread(target=_compactar_com_log, name="compactacao-snapshot", daemon=True).start()
+
+def carregar_do_db():
+    eventos_do_db = Evento.query.order_by(Evento.timestamp, Evento.id).all()
+    if not eventos_do_db:
+        log.info("Nenhum evento anterior encontrado no DB.")
+    
+    # A consulta já vem ordenada por timestamp: monta os blocos do índice
+    # direto, sem passar pela inserção evento a evento, e alimenta os
+    # agregados de risco na mesma passada.
+    agora = time.time()
+
+    def entradas():
+        for evento in eventos_do_db:
+            RISK_AGGREGATES.add(evento.timestamp, evento.tipo, agora)
+            yield ((evento.timestamp, evento.id),
+                   {"tipo": evento.tipo, "lat": evento.lat, "lon": evento.lon,
+                    "acel": evento.acel, "dispositivo": evento.dispositivo})
+
+    FALL_DATA_TREE.bulk_load(entradas())
+    # A partir daqui, o feed só busca o que for gravado depois da carga.
+    EVENT_FEED.registrar([evento.id for evento in eventos_do_db])
+        
+    log.info("%d eventos carregados do DB para a memória.", len(eventos_do_db))
+
+def migrar_esquema():
+    """
+    Acrescenta a coluna `dispositivo` e o índice (dispositivo, timestamp) em
+    bancos criados antes deles (db.create_all não altera tabelas existentes).
+    """
+    colunas = {coluna["name"] for coluna in inspect(db.engine).get_columns('evento')}
+    if 'dispositivo' not in colunas:
+        log.info("Migrando tabela evento: coluna dispositivo...")
+        with db.engine.begin() as conexao:
+            conexao.execute(text(
+                f"ALTER TABLE evento ADD COLUMN dispositivo VARCHAR({CARACTERES_TEXTO['dispositivo']}) "
+                f"NOT NULL DEFAULT '{DISPOSITIVO_PADRAO}'"
+            ))
+    for indice in Evento.__table__.indexes:
+        indice.create(db.engine, checkfirst=True)
+
 def carregar_db_para_abb():
-    print("-----------------------------------------------------")
-    print("Iniciando servidor...")
-    print("Criando tabelas do banco de dados (se não existirem)...")
+    log.info("Iniciando servidor...")
+    log.info("Criando tabelas do banco de dados (se não existirem)...")
     db.create_all()
+    migrar_esquema()
     
-    print("Carregando eventos do Banco de Dados para a Árvore (ABB)...")
+    do_snapshot = False
+    if SNAPSHOT_ATIVO:
+        log.info("Carregando eventos do snapshot para a memória...")
+        try:
+            do_snapshot = carregar_do_snapshot()
+        except Exception:
+            log.exception("Erro ao ler o snapshot")
+        if not do_snapshot:
+            # Descarta o que uma leitura parcial possa ter deixado.
+            FALL_DATA_TREE.limpar()
+            RISK_AGGREGATES.limpar()
+            EVENT_FEED.inicializar(0)
+
     try:
-        eventos_do_db = Evento.query.order_by(Evento.timestamp).all()
-        if not eventos_do_db:
-            print("Nenhum evento anterior encontrado no DB.")
-        
-        for evento in eventos_do_db:
-            payload = {"tipo": evento.tipo, "lat": evento.lat, "lon": evento.lon, "acel": evento.acel}
-            FALL_DATA_TREE.insert(evento.timestamp, payload)
-            
-        print(f"{len(eventos_do_db)} eventos carregados do DB para a memória.")
+        if not do_snapshot:
+            log.info("Carregando eventos do Banco de Dados para o índice...")
+            carregar_do_db()
+
+        # A grade espacial é montada a partir do índice recém-carregado; o
+        # que chegar daqui em diante entra pelo aplicar_em_memoria.
+        with INDICE_LOCK:
+            colunas, _ = FALL_DATA_TREE.slice_columns()
+            GEO_INDEX.carregar(colunas, FALL_DATA_TREE.textos)
+
+        # Traz o que foi gravado depois do snapshot/log (ou durante a carga).
+        sincronizar_com_outros_workers(forcar=True)
     
-    except Exception as e:
-        print(f"Erro ao carregar dados do DB: {e}")
-        print("Continuando com a árvore vazia...")
+    except Exception:
+        log.exception("Erro ao carregar dados do DB; continuando com o índice vazio")
+
+    # Um lote incompleto no meio do log esconderia os seguintes: compacta.
+    if SNAPSHOT_ATIVO and (not do_snapshot or EVENT_LOG.incompleto
+                           or EVENT_LOG.quantidade() > SNAPSHOT_MAX_WAL):
+        try:
+            compactar_snapshot()
+        except Exception:
+            log.exception("Erro ao gravar o snapshot")
     
-    print("-----------------------------------------------------")
-    print("  SERVIÇO INICIADO (Modo Híbrido) - Aguardando Conexões ")
-    print("-----------------------------------------------------")
+    log.info("SERVIÇO INICIADO (Modo Híbrido) - Aguardando Conexões")
 
 
 with app.app_context():
@@ -0,0 +1,79 @@
+"""Utilitários compartilhados pelos benchmarks."""
+import os
+import random
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+
+def carregar_app(database_url=None):
+    """
+    Importa o app apontando para um banco descartável (SQLite temporário),
+    a menos que DATABASE_URL seja informado.
+    """
+    pasta = tempfile.mkdtemp(prefix="cuida_bench_")
+    if database_url is None:
+        database_url = f"sqlite:///{os.path.join(pasta, 'bench.sqlite')}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("SNAPSHOT_DIR", pasta)
+    import app as modulo_app
+    return modulo_app
+
+
+def cronometrar(fn, repeticoes=1):
+    """Executa fn `repeticoes` vezes e retorna o tempo médio em segundos."""
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        fn()
+    return (time.perf_counter() - inicio) / repeticoes
+
+
+def payload_sintetico(i):
+    return {
+        "tipo": "queda" if i % 3 else "panico",
+        "lat": -23.55 + (i % 1000) * 1e-4,
+        "lon": -46.63 + (i % 997) * 1e-4,
+        "acel": "2.1g",
+    }
+
+
+def popular(modulo_app, n, dispositivos=("padrao",), janela=365 * 86400, semente=42,
+            pela_ingestao=False, recarregar=True, lote=50_000):
+    """
+    Grava n eventos sintéticos (sementes fixas): timestamps nos últimos
+    `janela` segundos, 60% quedas, em torno do centro de São Paulo, cada um
+    em um dos `dispositivos`. Por padrão, insere direto na tabela Evento e
+    depois recarrega o índice (recarregar); com pela_ingestao, passa por
+    gravar_lote (DB, memória e log do snapshot), como a API.
+    """
+    rnd = random.Random(semente)
+    agora = int(time.time())
+    with modulo_app.app.app_context():
+        tabela = modulo_app.Evento.__table__
+        for inicio in range(0, n, lote):
+            linhas = [{"timestamp": agora - rnd.randint(0, janela),
+                       "tipo": "queda" if rnd.random() < 0.6 else "panico",
+                       "lat": -23.55 + rnd.gauss(0, 0.1), "lon": -46.63 + rnd.gauss(0, 0.1),
+                       "acel": f"{rnd.uniform(1, 4):.1f}g",
+                       "dispositivo": rnd.choice(dispositivos)}
+                      for _ in range(inicio, min(n, inicio + lote))]
+            if pela_ingestao:
+                modulo_app.gravar_lote(linhas)
+            else:
+                modulo_app.db.session.execute(tabela.insert(), linhas)
+                modulo_app.db.session.commit()
+    if recarregar:
+        recarregar_indice(modulo_app)
+
+
+def recarregar_indice(modulo_app):
+    """Esvazia o estado em memória e o remonta como na inicialização do app."""
+    modulo_app.FALL_DATA_TREE.limpar()
+    modulo_app.RISK_AGGREGATES.limpar()
+    modulo_app.EVENT_FEED.inicializar(0)
+    with modulo_app.app.app_context():
+        modulo_app.carregar_db_para_abb()
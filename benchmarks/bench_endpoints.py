@@ -0,0 +1,139 @@
+"""
+Benchmark: latência dos endpoints pelo test client do Flask, com comparação.
+
+Uso:
+    python benchmarks/bench_endpoints.py [--eventos 100000] [--repeticoes 200]
+                                         [--saida atual.json] [--base anterior.json]
+                                         [--tolerancia 0.2]
+
+Popula um SQLite temporário (sementes fixas), sobe o app pelo mesmo
+caminho da inicialização e mede cada cenário N vezes: mediana, p95, p99 e
+máximo. No fim, lê /metrics e mostra o tempo médio de cada etapa interna
+(commit no DB, inserção no índice, serialização, análise de risco...).
+
+Com --saida, grava os números em JSON; com --base, compara a mediana de
+cada cenário com um resultado anterior e sai com código 1 se algum ficou
+mais lento que a tolerância.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from _comum import carregar_app, popular
+
+DISPOSITIVOS = 20
+
+
+def _evento(i):
+    return {"tipo_evento": "queda" if i % 3 else "panico", "latitude": -23.55 + (i % 100) * 1e-4,
+            "longitude": -46.63, "aceleracao": "2.3g", "dispositivo": f"esp-{i % DISPOSITIVOS}"}
+
+
+def cenarios(cliente):
+    """(nome, função que faz uma requisição e devolve o status)."""
+    contador = iter(range(10**9))
+    ontem = int(time.time()) - 86400
+
+    def get(url):
+        def fn():
+            resposta = cliente.get(url)
+            resposta.data  # consome o corpo (as respostas podem vir em partes)
+            return resposta.status_code
+        return fn
+
+    def post(url, corpo):
+        return lambda: cliente.post(url, json=corpo()).status_code
+
+    return [
+        ("POST reportar_evento", post("/api/reportar_evento", lambda: _evento(next(contador)))),
+        ("POST reportar_eventos (100)", post("/api/reportar_eventos",
+                                             lambda: [_evento(next(contador)) for _ in range(100)])),
+        ("GET eventos limit=500", get("/api/eventos?limit=500")),
+        ("GET eventos últimas 24h", get(f"/api/eventos?since={ontem}&limit=500")),
+        ("GET eventos dispositivo", get("/api/eventos?dispositivo=esp-1&limit=500")),
+        ("GET eventos completo", get("/api/eventos")),
+        ("GET analise_de_risco", get("/api/analise_de_risco")),
+        ("GET risco historico 30d", get("/api/analise_de_risco/historico?dias=30")),
+        ("GET proximos 500 m", get("/api/eventos/proximos?lat=-23.55&lon=-46.63&raio=500")),
+        ("GET agrupamentos 30d", get("/api/eventos/agrupamentos?dias=30&tipo=queda")),
+        ("GET metrics", get("/metrics")),
+    ]
+
+
+def medir(fn, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        status = fn()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        if status >= 400:
+            raise RuntimeError(f"status {status}")
+    tempos.sort()
+    def percentil(p):
+        return tempos[min(len(tempos) - 1, int(len(tempos) * p))]
+    return {"mediana_ms": statistics.median(tempos), "p95_ms": percentil(0.95),
+            "p99_ms": percentil(0.99), "max_ms": tempos[-1], "n": repeticoes}
+
+
+def etapas(texto_metricas):
+    """Tempo médio (ms) de cada histograma sem rótulos de /metrics."""
+    somas, contagens = {}, {}
+    for linha in texto_metricas.splitlines():
+        if linha.startswith("#") or "{" in linha:
+            continue
+        nome, valor = linha.rsplit(" ", 1)
+        if nome.endswith("_sum"):
+            somas[nome[:-4]] = float(valor)
+        elif nome.endswith("_count"):
+            contagens[nome[:-6]] = float(valor)
+    return {nome: (somas[nome] / contagens[nome] * 1000, int(contagens[nome]))
+            for nome in somas if contagens.get(nome) and nome.endswith("_segundos")}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--eventos", type=int, default=100_000)
+    parser.add_argument("--repeticoes", type=int, default=200)
+    parser.add_argument("--saida")
+    parser.add_argument("--base")
+    parser.add_argument("--tolerancia", type=float, default=0.2)
+    args = parser.parse_args()
+
+    modulo_app = carregar_app()
+    popular(modulo_app, args.eventos, dispositivos=[f"esp-{i}" for i in range(DISPOSITIVOS)])
+    cliente = modulo_app.app.test_client()
+
+    resultados = {}
+    print(f"\n== {args.eventos:,} eventos, {args.repeticoes} repetições por cenário ==")
+    print(f"{'cenário':<30}{'mediana':>10}{'p95':>10}{'p99':>10}{'máx':>10}  (ms)")
+    for nome, fn in cenarios(cliente):
+        repeticoes = max(5, args.repeticoes // 20) if "completo" in nome else args.repeticoes
+        fn()  # aquecimento (carga lazy de partições, caches)
+        r = resultados[nome] = medir(fn, repeticoes)
+        print(f"{nome:<30}{r['mediana_ms']:10.2f}{r['p95_ms']:10.2f}{r['p99_ms']:10.2f}{r['max_ms']:10.2f}")
+
+    print("\netapas internas (média, /metrics)")
+    for nome, (media, total) in etapas(cliente.get("/metrics").data.decode()).items():
+        print(f"  {nome:<38}{media:9.3f} ms  ({total:,} medições)")
+
+    if args.saida:
+        with open(args.saida, "w") as arquivo:
+            json.dump({"eventos": args.eventos, "cenarios": resultados}, arquivo, indent=2)
+
+    if args.base:
+        with open(args.base) as arquivo:
+            base = json.load(arquivo)["cenarios"]
+        regressoes = 0
+        print(f"\ncomparação com {args.base} (mediana)")
+        for nome, r in resultados.items():
+            if nome not in base:
+                continue
+            variacao = r["mediana_ms"] / base[nome]["mediana_ms"] - 1
+            marca = ""
+            if variacao > args.tolerancia:
+                marca, regressoes = "  <- REGRESSÃO", regressoes + 1
+            print(f"  {nome:<30}{base[nome]['mediana_ms']:9.2f} -> {r['mediana_ms']:9.2f} ms"
+                  f"  ({variacao:+.0%}){marca}")
+        sys.exit(1 if regressoes else 0)
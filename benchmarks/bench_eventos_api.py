@@ -0,0 +1,48 @@
+"""
+Benchmark: /api/eventos completo x incremental (cursor + limit).
+
+Uso:
+    python benchmarks/bench_eventos_api.py [--tamanhos 10000,100000]
+
+Simula o polling do dashboard: a primeira carga lê tudo, as seguintes pedem
+apenas o que chegou depois do último cursor.
+"""
+import argparse
+
+from _comum import carregar_app, cronometrar, payload_sintetico
+
+
+def rodar(modulo_app, n, novos=5):
+    indice = modulo_app.FALL_DATA_TREE
+    indice.limpar()
+    inicio = 1_700_000_000
+    indice.bulk_load(((inicio + i, i), payload_sintetico(i)) for i in range(n))
+    cliente = modulo_app.app.test_client()
+
+    completo = cronometrar(lambda: cliente.get("/api/eventos").data, repeticoes=5)
+
+    resposta = cliente.get(f"/api/eventos?since={inicio + n - 1}")
+    cursor = resposta.get_json()["proximo_cursor"]
+    for i in range(n, n + novos):
+        indice.insert((inicio + i, i), payload_sintetico(i))
+
+    def incremental():
+        r = cliente.get(f"/api/eventos?cursor={cursor}&limit=500")
+        assert r.get_json()["total"] == novos
+
+    parcial = cronometrar(incremental, repeticoes=50)
+    tamanho_completo = len(cliente.get("/api/eventos").data)
+    tamanho_parcial = len(cliente.get(f"/api/eventos?cursor={cursor}&limit=500").data)
+
+    print(f"\n== {n:,} eventos no índice, {novos} novos ==")
+    print(f"completo     {completo * 1000:9.2f} ms  {tamanho_completo:>12,} bytes")
+    print(f"incremental  {parcial * 1000:9.2f} ms  {tamanho_parcial:>12,} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tamanhos", default="10000,100000")
+    args = parser.parse_args()
+    modulo_app = carregar_app()
+    for tamanho in args.tamanhos.split(","):
+        rodar(modulo_app, int(tamanho))
@@ -0,0 +1,116 @@
+"""
+Benchmark: consultas espaciais pela grade (GEO_INDEX) x varredura completa.
+
+Uso:
+    python benchmarks/bench_geoespacial.py [--eventos 1000000]
+
+Espalha os eventos pela região metropolitana de São Paulo, com alguns
+pontos de concentração, monta o índice e a grade como na inicialização e
+compara, para cada consulta, a grade com duas varreduras de todos os
+eventos: uma em Python (items() do índice) e uma vetorizada (NumPy sobre
+as colunas inteiras). Os resultados das três são conferidos entre si.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from _comum import carregar_app, cronometrar
+
+CENTRO = (-23.55, -46.63)
+
+
+def popular(modulo_app, n):
+    rnd = np.random.default_rng(12)
+    focos = CENTRO + rnd.normal(0, 0.15, size=(20, 2))
+    perto = rnd.random(n) < 0.3
+    lat = np.where(perto, focos[rnd.integers(0, 20, n), 0] + rnd.normal(0, 0.003, n),
+                   CENTRO[0] + rnd.uniform(-0.5, 0.5, n))
+    lon = np.where(perto, focos[rnd.integers(0, 20, n), 1] + rnd.normal(0, 0.003, n),
+                   CENTRO[1] + rnd.uniform(-0.5, 0.5, n))
+    agora = int(time.time())
+    ts = np.sort(agora - rnd.integers(0, 365 * 86400, n))
+    tipos = np.where(rnd.random(n) < 0.6, "queda", "panico")
+
+    indice = modulo_app.FALL_DATA_TREE
+    indice.limpar()
+    indice.bulk_load(
+        ((timestamp, evento_id), {"tipo": tipo, "lat": la, "lon": lo, "acel": "2.1g",
+                                  "dispositivo": "padrao"})
+        for evento_id, (timestamp, tipo, la, lo) in
+        enumerate(zip(ts.tolist(), tipos.tolist(), lat.tolist(), lon.tolist()), start=1)
+    )
+    colunas, _ = indice.slice_columns()
+    carga = cronometrar(lambda: modulo_app.GEO_INDEX.carregar(colunas, indice.textos))
+    return colunas, carga
+
+
+def varredura_python(indice, filtro):
+    return sorted(chave[1] for chave, data in indice.items() if filtro(chave[0], data))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--eventos", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    modulo_app = carregar_app()
+    colunas, carga = popular(modulo_app, args.eventos)
+    indice, grade = modulo_app.FALL_DATA_TREE, modulo_app.GEO_INDEX
+    from geoespacial import distancias_metros
+    todas = {nome: np.array(getattr(colunas, nome)) for nome in ("ts", "ids", "lat", "lon")}
+    agora = int(time.time())
+    desde = agora - 30 * 86400
+
+    print(f"\n== {args.eventos:,} eventos, grade de {grade.passo} graus ==")
+    print(f"montagem da grade (inicialização)  {carga * 1000:9.1f} ms")
+
+    def raio(lat, lon, metros):
+        return (
+            lambda: sorted(grade.raio(lat, lon, metros)[0]["ids"].tolist()),
+            lambda: sorted(todas["ids"][
+                distancias_metros(lat, lon, todas["lat"], todas["lon"]) <= metros].tolist()),
+            lambda: varredura_python(indice, lambda ts, d: float(
+                distancias_metros(lat, lon, d["lat"], d["lon"])) <= metros),
+        )
+
+    def caixa(lat_min, lat_max, lon_min, lon_max, since=None):
+        def na_caixa(ts, d):
+            return (lat_min <= d["lat"] <= lat_max and lon_min <= d["lon"] <= lon_max
+                    and (since is None or ts >= since))
+        def numpy_completo():
+            mascara = ((todas["lat"] >= lat_min) & (todas["lat"] <= lat_max)
+                       & (todas["lon"] >= lon_min) & (todas["lon"] <= lon_max))
+            if since is not None:
+                mascara &= todas["ts"] >= since
+            return sorted(todas["ids"][mascara].tolist())
+        return (
+            lambda: sorted(grade.caixa(lat_min, lat_max, lon_min, lon_max, since=since)["ids"].tolist()),
+            numpy_completo,
+            lambda: varredura_python(indice, na_caixa),
+        )
+
+    consultas = [
+        ("raio 200 m", raio(*CENTRO, 200)),
+        ("raio 1 km", raio(*CENTRO, 1000)),
+        ("raio 5 km", raio(*CENTRO, 5000)),
+        ("caixa 0,02° (~2 km)", caixa(-23.56, -23.54, -46.64, -46.62)),
+        ("caixa 0,2°, 30 dias", caixa(-23.65, -23.45, -46.73, -46.53, since=desde)),
+    ]
+    print(f"{'consulta':<22}{'achados':>9}{'grade':>12}{'NumPy':>12}{'Python':>12}")
+    for rotulo, (pela_grade, numpy_completo, python_completo) in consultas:
+        achados = pela_grade()
+        assert achados == numpy_completo() == python_completo(), rotulo
+        tempos = [cronometrar(fn, repeticoes=repeticoes) * 1000 for fn, repeticoes in
+                  ((pela_grade, 20), (numpy_completo, 3), (python_completo, 1))]
+        print(f"{rotulo:<22}{len(achados):>9,}" + "".join(f"{t:9.2f} ms" for t in tempos))
+
+    cliente = modulo_app.app.test_client()
+    for rotulo, url in [
+        ("GET proximos 200 m", "/api/eventos/proximos?lat=-23.55&lon=-46.63&raio=200"),
+        ("GET area 0,02°", "/api/eventos/area?lat_min=-23.56&lat_max=-23.54&lon_min=-46.64&lon_max=-46.62"),
+        ("GET agrupamentos 30 dias", "/api/eventos/agrupamentos?dias=30&tipo=queda"),
+        ("GET agrupamentos tudo", "/api/eventos/agrupamentos"),
+    ]:
+        duracao = cronometrar(lambda: cliente.get(url).data, repeticoes=5)
+        print(f"{rotulo:<28}{duracao * 1000:9.2f} ms")
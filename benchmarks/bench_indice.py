@@ -0,0 +1,116 @@
+"""
+Benchmark: índice ordenado (bst.OrderedEventIndex) x ABB original.
+
+Uso:
+    python benchmarks/bench_indice.py [--tamanhos 10000,100000,1000000]
+
+A ABB original é reproduzida aqui apenas como referência. Com timestamps
+chegando em ordem (como no carregamento do DB) ela vira uma lista encadeada
+e estoura o limite de recursão do Python; nesse caso o resultado é reportado
+como "RecursionError" e medimos também a inserção embaralhada.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bst import OrderedEventIndex  # noqa: E402
+
+
+class LegacyNode:
+    def __init__(self, key, data):
+        self.key = key
+        self.data = data
+        self.left = None
+        self.right = None
+
+
+class LegacyBinarySearchTree:
+    """Cópia da ABB original (recursiva e sem balanceamento)."""
+    def __init__(self):
+        self.root = None
+
+    def insert(self, key, data):
+        if self.root is None:
+            self.root = LegacyNode(key, data)
+        else:
+            self._insert_recursive(self.root, key, data)
+
+    def _insert_recursive(self, node, key, data):
+        if key < node.key:
+            if node.left is None:
+                node.left = LegacyNode(key, data)
+            else:
+                self._insert_recursive(node.left, key, data)
+        elif key > node.key:
+            if node.right is None:
+                node.right = LegacyNode(key, data)
+            else:
+                self._insert_recursive(node.right, key, data)
+
+    def inorder_traversal(self, node):
+        res = []
+        if node:
+            res.extend(self.inorder_traversal(node.left))
+            res.append({"key": node.key, "data": node.data})
+            res.extend(self.inorder_traversal(node.right))
+        return res
+
+    def get_all_events_sorted(self):
+        return self.inorder_traversal(self.root)
+
+
+def _cronometrar(fn):
+    inicio = time.perf_counter()
+    try:
+        fn()
+    except RecursionError:
+        return "RecursionError"
+    return f"{time.perf_counter() - inicio:8.3f}s"
+
+
+def _payload(i):
+    return {"tipo": "queda" if i % 2 else "panico", "lat": -23.5, "lon": -46.6, "acel": "2.1g",
+            "dispositivo": "padrao"}
+
+
+def rodar(n):
+    # Chave composta (timestamp, id), como no app.
+    chaves = [(1_700_000_000 + i, i) for i in range(n)]
+    embaralhadas = chaves[:]
+    random.Random(42).shuffle(embaralhadas)
+    pares = [(k, _payload(k[1])) for k in chaves]
+    amostra = random.Random(7).sample(chaves, min(n, 10_000))
+
+    print(f"\n== {n:,} eventos ==")
+
+    idx = OrderedEventIndex()
+    print("novo   bulk_load ordenado     ", _cronometrar(lambda: idx.bulk_load(pares)))
+    print("novo   busca 10k chaves       ", _cronometrar(lambda: [idx.get(k) for k in amostra]))
+    print("novo   percurso completo      ", _cronometrar(idx.get_all_events_sorted))
+
+    idx2 = OrderedEventIndex()
+    print("novo   insert ordenado        ",
+          _cronometrar(lambda: [idx2.insert(k, d) for k, d in pares]))
+    idx3 = OrderedEventIndex()
+    print("novo   insert embaralhado     ",
+          _cronometrar(lambda: [idx3.insert(k, pares[k[1]][1]) for k in embaralhadas]))
+
+    antiga = LegacyBinarySearchTree()
+    print("antiga insert ordenado        ",
+          _cronometrar(lambda: [antiga.insert(k, d) for k, d in pares]))
+    antiga = LegacyBinarySearchTree()
+    print("antiga insert embaralhado     ",
+          _cronometrar(lambda: [antiga.insert(k, pares[k[1]][1]) for k in embaralhadas]))
+    print("antiga percurso completo      ", _cronometrar(antiga.get_all_events_sorted))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tamanhos", default="10000,100000,1000000")
+    args = parser.parse_args()
+    for tamanho in args.tamanhos.split(","):
+        rodar(int(tamanho))
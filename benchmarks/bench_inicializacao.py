@@ -0,0 +1,71 @@
+"""
+Benchmark: tempo de inicialização (carga do índice) a partir do DB x snapshot.
+
+Uso:
+    python benchmarks/bench_inicializacao.py [--tamanhos 100000,1000000] [--log 10000]
+
+Para cada tamanho, popula um SQLite temporário e mede, em subprocessos, o
+tempo de `import app` (que executa carregar_db_para_abb):
+  - DB:              SNAPSHOT_ATIVO=0, o caminho antigo
+  - DB + snapshot:   primeira subida, carrega do DB e grava o snapshot
+  - snapshot:        subidas seguintes
+  - snapshot + log:  com --log eventos gravados depois do snapshot
+As bibliotecas são importadas antes de começar a medir.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from _comum import RAIZ
+
+CODIGO_MEDICAO = (
+    "import time, flask, flask_sqlalchemy, numpy, pytz; "
+    "inicio = time.perf_counter(); "
+    "import app; "
+    "print(time.perf_counter() - inicio)"
+)
+
+CODIGO_POPULAR = (
+    "import sys; "
+    f"sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r}); "
+    "import app; "
+    "from _comum import popular; "
+    "popular(app, int(sys.argv[1]), semente=int(sys.argv[1]), "
+    "pela_ingestao=sys.argv[2] == '1', recarregar=False)"
+)
+
+
+def _rodar(ambiente, *args, codigo=CODIGO_MEDICAO):
+    saida = subprocess.run(
+        [sys.executable, "-c", codigo, *args], cwd=RAIZ, env=ambiente,
+        capture_output=True, text=True, check=True).stdout
+    return saida.strip().splitlines()[-1]
+
+
+def rodar(n, eventos_log):
+    pasta = tempfile.mkdtemp(prefix="cuida_inicio_")
+    ambiente = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(pasta, 'db.sqlite')}",
+                    SNAPSHOT_DIR=pasta, SNAPSHOT_MAX_WAL=str(10 * n))
+    sem_snapshot = dict(ambiente, SNAPSHOT_ATIVO="0")
+    _rodar(sem_snapshot, str(n), "0", codigo=CODIGO_POPULAR)
+
+    print(f"\n== {n:,} eventos ==")
+    print(f"DB              {float(_rodar(sem_snapshot)) * 1000:10.1f} ms")
+    print(f"DB + snapshot   {float(_rodar(ambiente)) * 1000:10.1f} ms")
+    print(f"snapshot        {float(_rodar(ambiente)) * 1000:10.1f} ms")
+    if eventos_log:
+        _rodar(dict(ambiente, GROUP_COMMIT_JANELA_MS="0"), str(eventos_log), "1",
+               codigo=CODIGO_POPULAR)
+        print(f"snapshot + log  {float(_rodar(ambiente)) * 1000:10.1f} ms"
+              f"  ({eventos_log:,} eventos no log)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tamanhos", default="100000,1000000")
+    parser.add_argument("--log", type=int, default=10000)
+    args = parser.parse_args()
+    for tamanho in args.tamanhos.split(","):
+        rodar(int(tamanho), args.log)
@@ -0,0 +1,106 @@
+"""
+Benchmark: memória por evento e vazão da serialização JSON, layout colunar x Node.
+
+Uso:
+    python benchmarks/bench_memoria.py [--tamanhos 100000,1000000]
+
+Compara o índice atual (bst.OrderedEventIndex, arrays tipados por bloco e
+textos internados) com a ABB original de bench_indice.py, um objeto Node
+com __dict__ e um dict de payload por evento. Os payloads são montados com
+json.loads, como chegam do request, cada um com uma leitura de aceleração
+diferente (como as do sensor), e a memória é o que fica alocado
+(tracemalloc) depois que a entrada é descartada.
+
+Serialização:
+  - Node:     inorder_traversal() + json.dumps, como o /api/eventos antigo
+  - dicts:    irange() + um dict por evento + json.dumps
+  - colunas:  slice_columns() + serializacao.eventos_json (o /api/eventos atual)
+"""
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from _comum import RAIZ  # noqa: F401  (coloca a raiz do repositório no sys.path)
+from bench_indice import LegacyBinarySearchTree
+from bst import OrderedEventIndex
+from serializacao import eventos_json
+
+sys.setrecursionlimit(10_000)
+
+MODELO = ('{{"tipo": "{tipo}", "lat": {lat}, "lon": {lon}, "acel": "{acel}g", '
+          '"dispositivo": "esp-{dispositivo}"}}')
+
+
+def _payloads(chaves):
+    for timestamp, evento_id in chaves:
+        yield (timestamp, evento_id), json.loads(MODELO.format(
+            tipo="queda" if evento_id % 3 else "panico",
+            lat=-23.55 + (evento_id % 1000) * 1e-4, lon=-46.63 + (evento_id % 997) * 1e-4,
+            acel=f"{evento_id * 2654435761 % 8_000_000 / 1e6:.6f}", dispositivo=evento_id % 50))
+
+
+def _memoria(construir):
+    """Retorna (estrutura, bytes que continuam alocados depois de construir)."""
+    gc.collect()
+    tracemalloc.start()
+    estrutura = construir()
+    gc.collect()
+    alocado = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return estrutura, alocado
+
+
+def _vazao(fn, n):
+    inicio = time.perf_counter()
+    saida = fn()
+    duracao = time.perf_counter() - inicio
+    return f"{duracao * 1000:9.1f} ms  {n / duracao / 1e6:6.2f} M eventos/s  {len(saida) / 1e6:7.1f} MB"
+
+
+def rodar(n):
+    chaves = [(1_700_000_000 + i // 3, i) for i in range(n)]
+    # A ABB original só sobrevive (sem RecursionError) a inserções fora de ordem.
+    embaralhadas = chaves[:]
+    random.Random(42).shuffle(embaralhadas)
+
+    def montar_node():
+        arvore = LegacyBinarySearchTree()
+        for chave, payload in _payloads(embaralhadas):
+            arvore.insert(chave, payload)
+        return arvore
+
+    def montar_colunas():
+        indice = OrderedEventIndex()
+        indice.bulk_load(_payloads(chaves))
+        return indice
+
+    arvore, bytes_node = _memoria(montar_node)
+    indice, bytes_colunas = _memoria(montar_colunas)
+
+    print(f"\n== {n:,} eventos ==")
+    print(f"memória Node      {bytes_node / n:7.1f} bytes/evento  ({bytes_node / 1e6:8.1f} MB)")
+    print(f"memória colunas   {bytes_colunas / n:7.1f} bytes/evento  ({bytes_colunas / 1e6:8.1f} MB)")
+
+    separadores = (',', ':')
+    print("serializa Node    ", _vazao(lambda: json.dumps(
+        arvore.get_all_events_sorted(), separators=separadores, sort_keys=True), n))
+    print("serializa dicts   ", _vazao(lambda: json.dumps(
+        [{"key": chave[0], "id": chave[1], "data": data} for chave, data in indice.irange()],
+        separators=separadores, sort_keys=True), n))
+
+    def colunas():
+        faixa, _ = indice.slice_columns()
+        return "[" + "".join(eventos_json(faixa, indice.textos)) + "]"
+    print("serializa colunas ", _vazao(colunas, n))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tamanhos", default="100000,1000000")
+    args = parser.parse_args()
+    for tamanho in args.tamanhos.split(","):
+        rodar(int(tamanho))
@@ -0,0 +1,44 @@
+"""
+Benchmark: consultas por dispositivo (partições) x índice global.
+
+Uso:
+    python benchmarks/bench_particoes.py [--dispositivos 100] [--eventos 500000]
+
+Grava os eventos espalhados entre os dispositivos, com um deles bem menor
+que os outros, e mede /api/eventos e /api/analise_de_risco com e sem
+?dispositivo=. A primeira consulta de um dispositivo inclui a carga lazy
+da partição; as seguintes leem só da memória dela.
+"""
+import argparse
+from _comum import carregar_app, cronometrar, popular
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dispositivos", type=int, default=100)
+    parser.add_argument("--eventos", type=int, default=500_000)
+    args = parser.parse_args()
+
+    modulo_app = carregar_app()
+    popular(modulo_app, args.eventos, semente=5, recarregar=False,
+            dispositivos=[f"esp-{i}" for i in range(1, args.dispositivos)])
+    # esp-0: poucos eventos, todos nas últimas 50 horas.
+    popular(modulo_app, 50, dispositivos=["esp-0"], janela=50 * 3600, semente=6)
+    cliente = modulo_app.app.test_client()
+
+    print(f"\n== {args.eventos:,} eventos em {args.dispositivos} dispositivos ==")
+    for rotulo, url in [
+        ("eventos global (limit 500)         ", "/api/eventos?limit=500"),
+        ("eventos esp-0, 1ª (carga lazy)      ", "/api/eventos?dispositivo=esp-0"),
+        ("eventos esp-0                       ", "/api/eventos?dispositivo=esp-0"),
+        ("eventos esp-1, 1ª (carga lazy)      ", "/api/eventos?dispositivo=esp-1&limit=500"),
+        ("eventos esp-1 (limit 500)           ", "/api/eventos?dispositivo=esp-1&limit=500"),
+        ("risco global                        ", "/api/analise_de_risco"),
+        ("risco esp-0                         ", "/api/analise_de_risco?dispositivo=esp-0"),
+        ("histórico esp-0                     ", "/api/analise_de_risco/historico?dispositivo=esp-0"),
+        ("histórico global                    ", "/api/analise_de_risco/historico"),
+    ]:
+        duracao = cronometrar(lambda: cliente.get(url).data)
+        print(f"{rotulo} {duracao * 1000:9.2f} ms")
+    print(f"partições em memória: {len(modulo_app.PARTICOES)}, "
+          f"eventos nelas: {modulo_app.PARTICOES.total_eventos():,}")
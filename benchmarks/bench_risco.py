@@ -0,0 +1,32 @@
+"""
+Benchmark: /api/analise_de_risco com agregados incrementais x varredura completa.
+
+Uso:
+    python benchmarks/bench_risco.py [--linhas 1000000]
+
+Grava as linhas direto na tabela Evento (SQLite temporário), monta o
+índice e os agregados como na inicialização e compara o tempo da resposta
+normal com o da verificação (?verificar=1), que refaz a contagem
+percorrendo o DB.
+"""
+import argparse
+from _comum import carregar_app, cronometrar, popular
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--linhas", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    modulo_app = carregar_app()
+    popular(modulo_app, args.linhas)
+    cliente = modulo_app.app.test_client()
+
+    agregado = cronometrar(lambda: cliente.get("/api/analise_de_risco"), repeticoes=20)
+    resposta = cliente.get("/api/analise_de_risco?verificar=1")
+    varredura = cronometrar(lambda: cliente.get("/api/analise_de_risco?verificar=1"))
+
+    print(f"\n== {args.linhas:,} linhas ==")
+    print(f"agregados            {agregado * 1000:10.2f} ms")
+    print(f"varredura (verificar){varredura * 1000:10.2f} ms")
+    print(f"consistente: {resposta.get_json().get('consistente')}")
@@ -0,0 +1,77 @@
+"""
+Benchmark: heurísticas de risco no caminho colunar (NumPy) x por linha.
+
+Uso:
+    python benchmarks/bench_risco_vetorizado.py [--tamanhos 1000000,5000000]
+                                                [--comparar 1000000] [--endpoint 1000000]
+
+Gera colunas sintéticas cobrindo vários anos (inclusive o período com
+horário de verão) e mede analisar_colunas() para a história toda e para
+janelas de 30/90/365 dias. Com --comparar, confere o resultado contra a
+varredura linha a linha (risco.contagens_por_varredura) nessa quantidade.
+Com --endpoint, popula um SQLite temporário com essa quantidade de eventos e
+mede /api/analise_de_risco/historico de ponta a ponta (pelo test client),
+conferindo as contagens contra a varredura do DB.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from _comum import carregar_app, cronometrar, popular
+from risco import contagens_por_varredura
+from risco_vetorizado import analisar_colunas
+
+
+def colunas_sinteticas(n, agora, semente=0):
+    rnd = np.random.default_rng(semente)
+    return {
+        "timestamp": rnd.integers(1_200_000_000, int(agora), size=n, dtype=np.int64),
+        "tipo": rnd.choice(np.array(["queda", "panico"]), size=n),
+        "lat": rnd.uniform(-23.6, -23.5, size=n),
+        "lon": rnd.uniform(-46.7, -46.6, size=n),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tamanhos", default="1000000,5000000")
+    parser.add_argument("--comparar", type=int, default=0)
+    parser.add_argument("--endpoint", type=int, default=0)
+    args = parser.parse_args()
+    agora = time.time()
+
+    for tamanho in map(int, args.tamanhos.split(",")):
+        colunas = colunas_sinteticas(tamanho, agora)
+        print(f"\n== {tamanho:,} eventos ==")
+        for dias in (None, 365, 90, 30):
+            duracao = cronometrar(lambda: analisar_colunas(colunas, agora, dias), repeticoes=3)
+            rotulo = "histórico completo" if dias is None else f"janela {dias} dias"
+            print(f"vetorizado {rotulo:<20} {duracao * 1000:9.1f} ms")
+
+    if args.comparar:
+        colunas = colunas_sinteticas(args.comparar, agora)
+        inicio = time.perf_counter()
+        esperado = contagens_por_varredura(
+            zip(colunas["timestamp"].tolist(), colunas["tipo"].tolist()), agora)
+        por_linha = time.perf_counter() - inicio
+        obtido, _ = analisar_colunas(colunas, agora)
+        print(f"\npor linha ({args.comparar:,} eventos) {por_linha * 1000:9.1f} ms")
+        print(f"resultados iguais: {obtido == esperado}")
+
+    if args.endpoint:
+        modulo_app = carregar_app()
+        popular(modulo_app, args.endpoint, dispositivos=[f"esp-{i}" for i in range(20)])
+        cliente = modulo_app.app.test_client()
+        print(f"\n== /api/analise_de_risco/historico, {args.endpoint:,} eventos no DB ==")
+        for parametros in ("", "?dias=365", "?dias=30", "?dispositivo=esp-1"):
+            url = "/api/analise_de_risco/historico" + parametros
+            duracao = cronometrar(lambda: cliente.get(url).data, repeticoes=5)
+            print(f"{parametros or '(histórico completo)':<22} {duracao * 1000:9.1f} ms")
+
+        agora = time.time()
+        with modulo_app.app.app_context():
+            linhas = modulo_app.db.session.query(modulo_app.Evento.timestamp, modulo_app.Evento.tipo)
+            esperado = contagens_por_varredura(linhas.yield_per(10000), agora)
+        obtido = cliente.get("/api/analise_de_risco/historico").get_json()["contagens"]
+        print(f"contagens iguais à varredura do DB: {obtido == esperado}")
@@ -0,0 +1,120 @@
+"""
+Benchmark: latência ponta a ponta e memória do /api/eventos/stream (SSE).
+
+Uso:
+    python benchmarks/bench_stream.py [--inscritos 300] [--eventos 50] [--gunicorn 1]
+
+Sobe o servidor em um subprocesso, abre N conexões SSE (uma thread cada),
+envia eventos por /api/reportar_evento e mede, para cada inscrito, o tempo
+entre o início do POST e a chegada do evento no stream. A memória é o RSS
+do servidor (Linux, /proc; com o gunicorn, master e workers somados) antes
+e depois das inscrições.
+
+Com --gunicorn N, o servidor é o gunicorn com N workers e a configuração do
+projeto (gunicorn.conf.py, worker gthread); GUNICORN_THREADS, se não vier do
+ambiente, é ajustado para caber todos os inscritos em um worker.
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from carga_ingestao import _evento, _subir_servidor
+
+
+def _rss_kb(pid):
+    """RSS do processo e de seus filhos (os workers, no gunicorn)."""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for linha in status:
+                if linha.startswith("VmRSS:"):
+                    total += int(linha.split()[1])
+        with open(f"/proc/{pid}/task/{pid}/children") as filhos:
+            total += sum(_rss_kb(int(filho)) for filho in filhos.read().split())
+    except OSError:
+        pass
+    return total
+
+
+def inscrever(host, porta, chegadas, prontos, total):
+    conexao = http.client.HTTPConnection(host, porta, timeout=60)
+    conexao.request("GET", "/api/eventos/stream")
+    resposta = conexao.getresponse()
+    prontos.release()
+    recebidos = 0
+    while recebidos < total:
+        linha = resposta.fp.readline()
+        if not linha:
+            break
+        if linha.startswith(b"data: "):
+            evento_id = json.loads(linha[6:])["id"]
+            chegadas.append((evento_id, time.perf_counter()))
+            recebidos += 1
+    conexao.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--inscritos", type=int, default=300)
+    parser.add_argument("--eventos", type=int, default=50)
+    parser.add_argument("--gunicorn", type=int, default=0, metavar="WORKERS")
+    args = parser.parse_args()
+    os.environ.setdefault("GUNICORN_THREADS", str(args.inscritos + 32))
+
+    caminho = os.path.join(tempfile.mkdtemp(prefix="cuida_stream_"), "stream.sqlite")
+    processo, base = _subir_servidor(f"sqlite:///{caminho}", 5, args.gunicorn)
+    host, porta = base.split("//")[1].split(":")
+    try:
+        rss_inicial = _rss_kb(processo.pid)
+        chegadas = []
+        prontos = threading.Semaphore(0)
+        threads = [
+            threading.Thread(target=inscrever, args=(host, int(porta), chegadas, prontos, args.eventos),
+                             daemon=True)
+            for _ in range(args.inscritos)
+        ]
+        for thread in threads:
+            thread.start()
+        for _ in threads:
+            prontos.acquire()
+        time.sleep(1.0)
+        rss_inscritos = _rss_kb(processo.pid)
+
+        envios = {}
+        for i in range(args.eventos):
+            inicio = time.perf_counter()
+            requisicao = json.dumps(_evento(i)).encode()
+            conexao = http.client.HTTPConnection(host, int(porta), timeout=30)
+            conexao.request("POST", "/api/reportar_evento", requisicao,
+                            {"Content-Type": "application/json"})
+            envios[json.loads(conexao.getresponse().read())["id"]] = inicio
+            conexao.close()
+            time.sleep(0.02)
+
+        for thread in threads:
+            thread.join(timeout=30)
+        rss_final = _rss_kb(processo.pid)
+
+        latencias = sorted((chegada - envios[evento_id]) * 1000
+                           for evento_id, chegada in chegadas if evento_id in envios)
+        esperado = args.inscritos * args.eventos
+        servidor = f"gunicorn, {args.gunicorn} worker(s)" if args.gunicorn else "servidor do Flask"
+        print(f"\n== {args.inscritos} inscritos, {args.eventos} eventos ({servidor}) ==")
+        print(f"entregas       {len(latencias):,} de {esperado:,}")
+        if latencias:
+            p99 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.99))]
+            print(f"latência       mediana {statistics.median(latencias):.1f} ms, "
+                  f"p99 {p99:.1f} ms, máx {latencias[-1]:.1f} ms")
+        print(f"RSS servidor   {rss_inicial / 1024:.1f} MB -> {rss_inscritos / 1024:.1f} MB "
+              f"com inscritos ({(rss_inscritos - rss_inicial) / max(1, args.inscritos):.1f} KB/inscrito)"
+              f" -> {rss_final / 1024:.1f} MB no fim")
+    finally:
+        processo.kill()
+        processo.wait()
+    sys.exit(0)
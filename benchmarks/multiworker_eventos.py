@@ -0,0 +1,88 @@
+"""
+Verificação multi-processo: todos os workers do gunicorn devem devolver o
+mesmo /api/eventos depois de gravações concorrentes.
+
+Uso:
+    python benchmarks/multiworker_eventos.py [--workers 4] [--eventos 2000]
+
+Sobe o gunicorn com --preload sobre um SQLite temporário, dispara gravações
+individuais e em lote em paralelo (que caem em workers diferentes), espera o
+intervalo do feed e faz leituras concorrentes para atingir todos os workers.
+Sai com código 1 se alguma resposta divergir ou faltar evento.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from _comum import RAIZ
+from carga_ingestao import _evento, _porta_livre, _post
+
+
+def _get(url):
+    requisicao = urllib.request.Request(url, headers={"Connection": "close"})
+    with urllib.request.urlopen(requisicao, timeout=30) as resposta:
+        return resposta.read()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--eventos", type=int, default=2000)
+    parser.add_argument("--leituras", type=int, default=200)
+    args = parser.parse_args()
+
+    porta = _porta_livre()
+    caminho = os.path.join(tempfile.mkdtemp(prefix="cuida_workers_"), "workers.sqlite")
+    ambiente = dict(os.environ, DATABASE_URL=f"sqlite:///{caminho}",
+                    SNAPSHOT_DIR=os.path.dirname(caminho))
+    servidor = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--preload", "-w", str(args.workers),
+         "--threads", "4", "-b", f"127.0.0.1:{porta}", "app:app"],
+        cwd=RAIZ, env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{porta}"
+
+    try:
+        for _ in range(100):
+            try:
+                _get(base + "/api/eventos?limit=1")
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        metade = args.eventos // 2
+        agora = int(time.time())
+        lotes = [[dict(_evento(i), timestamp=agora - i) for i in range(j, min(metade, j + 50))]
+                 for j in range(0, metade, 50)]
+
+        def escrever(i):
+            if i < len(lotes):
+                _post(base + "/api/reportar_eventos", lotes[i])
+            for k in range(i, args.eventos - metade, 32):
+                _post(base + "/api/reportar_evento", _evento(k))
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(32) as executor:
+            list(executor.map(escrever, range(32)))
+            # Leituras durante as gravações só para exercitar o feed.
+            list(executor.map(lambda _: _get(base + "/api/eventos?limit=10"), range(50)))
+        print(f"{args.eventos:,} eventos gravados em {time.perf_counter() - inicio:.2f}s")
+
+        time.sleep(0.5)
+        with ThreadPoolExecutor(16) as executor:
+            respostas = list(executor.map(lambda _: _get(base + "/api/eventos"), range(args.leituras)))
+
+        distintas = set(respostas)
+        totais = sorted({json.loads(r)["total"] for r in respostas})
+        print(f"{len(respostas)} leituras, {len(distintas)} resposta(s) distinta(s), totais={totais}")
+        ok = len(distintas) == 1 and totais == [args.eventos]
+        print("OK: todos os workers coerentes" if ok else "FALHA: workers divergem")
+        sys.exit(0 if ok else 1)
+    finally:
+        servidor.terminate()
+        servidor.wait()
@@ -1,51 +1,422 @@
-class Node:
-    """Representa um nó na Árvore Binária de Busca."""
-    def __init__(self, key, data):
-        self.key = key
-        self.data = data
-        self.left = None
-        self.right = None
-
-class BinarySearchTree:
-    """Implementa a lógica da Árvore Binária de Busca (ABB)."""
+from array import array
+from bisect import bisect_left, bisect_right
+import json
+
+
+# Formato da aceleração (coluna acel_formato). Uma leitura numérica fica no
+# próprio float da coluna acel, com as casas decimais e o sufixo "g" no
+# formato (ACEL_NUMERO + 2 * casas + 1 se tiver "g"), e volta ao texto
+# original sem passar por tabela. Só o que não é número (por exemplo "N/A")
+# vai para o StringTable, com o código guardado no float.
+ACEL_NULO = 0
+ACEL_TEXTO = 1
+ACEL_NUMERO = 2
+ACEL_MAX_CASAS = 15
+# Modelo de texto de cada formato numérico, na ordem de acel_formato.
+MODELOS_ACEL = tuple("%%.%df%s" % (casas, sufixo)
+                     for casas in range(ACEL_MAX_CASAS + 1) for sufixo in ("", "g"))
+
+
+def codificar_acel(texto, textos):
+    """Retorna (valor, formato) da aceleração; `textos` é o StringTable do índice."""
+    if texto is None:
+        return 0.0, ACEL_NULO
+    numero, sufixo = (texto[:-1], 1) if texto.endswith("g") else (texto, 0)
+    casas = len(numero) - numero.find(".") - 1 if "." in numero else 0
+    if casas <= ACEL_MAX_CASAS:
+        try:
+            valor = float(numero)
+        except ValueError:
+            valor = None
+        if valor is not None and "%.*f" % (casas, valor) == numero:
+            return valor, ACEL_NUMERO + 2 * casas + sufixo
+    return float(textos.codigo(texto)), ACEL_TEXTO
+
+
+def texto_acel(valor, formato, textos):
+    """Inverso de codificar_acel(); `textos` é a lista de textos do StringTable."""
+    if formato >= ACEL_NUMERO:
+        return MODELOS_ACEL[formato - ACEL_NUMERO] % valor
+    if formato == ACEL_TEXTO:
+        return textos[int(valor)]
+    return None
+
+
+class StringTable:
+    """
+    Textos repetidos dos eventos (tipo, dispositivo e acelerações que não
+    são números) guardados uma única vez; os eventos guardam só o código
+    inteiro. Cada texto já fica com sua forma JSON, usada pelo serializador.
+    A tabela só cresce, então um código lido sob o lock do índice continua
+    válido depois dele.
+    """
+
+    __slots__ = ("textos", "json", "_codigos")
+
+    def __init__(self, textos=()):
+        self.textos = []
+        self.json = []
+        self._codigos = {}
+        for texto in textos:
+            self.codigo(texto)
+
+    def __len__(self):
+        return len(self.textos)
+
+    def codigo(self, texto):
+        codigo = self._codigos.get(texto)
+        if codigo is None:
+            codigo = self._codigos[texto] = len(self.textos)
+            self.json.append(json.dumps(texto))
+            self.textos.append(texto)
+        return codigo
+
+    def existente(self, texto):
+        """Código de um texto já visto, ou None (não acrescenta à tabela)."""
+        return self._codigos.get(texto)
+
+
+class EventColumns:
+    """
+    Colunas paralelas de um trecho de eventos ordenado por (timestamp, id):
+    arrays tipados em vez de um objeto e um dict por evento (~50 bytes por
+    evento). Usado tanto como bloco do índice quanto como cópia de uma faixa
+    devolvida por OrderedEventIndex.slice_columns().
+    """
+
+    __slots__ = ("ts", "ids", "lat", "lon", "tipo", "acel", "acel_formato", "dispositivo")
+
+    TIPOS = (("ts", "q"), ("ids", "q"), ("lat", "d"), ("lon", "d"), ("tipo", "I"),
+             ("acel", "d"), ("acel_formato", "B"), ("dispositivo", "I"))
+
     def __init__(self):
-        self.root = None
+        for nome, tipo in self.TIPOS:
+            setattr(self, nome, array(tipo))
+
+    def __len__(self):
+        return len(self.ts)
+
+    def colunas(self):
+        return [getattr(self, nome) for nome in self.__slots__]
+
+    def chave(self, idx):
+        return (self.ts[idx], self.ids[idx])
+
+    def append(self, linha):
+        ts, evento_id, lat, lon, tipo, acel, acel_formato, dispositivo = linha
+        self.ts.append(ts)
+        self.ids.append(evento_id)
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self.tipo.append(tipo)
+        self.acel.append(acel)
+        self.acel_formato.append(acel_formato)
+        self.dispositivo.append(dispositivo)
+
+    def insert(self, idx, linha):
+        for coluna, valor in zip(self.colunas(), linha):
+            coluna.insert(idx, valor)
+
+    def extend_from(self, outro, inicio=0, fim=None):
+        for coluna, origem in zip(self.colunas(), outro.colunas()):
+            coluna.extend(origem[inicio:fim])
+
+    def split_off(self, idx):
+        """Move os eventos a partir de idx para um novo EventColumns."""
+        novo = EventColumns()
+        novo.extend_from(self, idx)
+        for coluna in self.colunas():
+            del coluna[idx:]
+        return novo
+
+    def position(self, key, direita=False):
+        """
+        Busca binária de uma chave (timestamp,), (timestamp, id) ou
+        (timestamp, inf), com a mesma ordem das tuplas: primeiro no
+        timestamp, depois no id dentro do trecho com o mesmo timestamp.
+        """
+        inicio = bisect_left(self.ts, key[0])
+        if len(key) == 1:
+            return inicio
+        fim = bisect_right(self.ts, key[0], inicio)
+        busca = bisect_right if direita else bisect_left
+        return busca(self.ids, key[1], inicio, fim)
+
+
+class OrderedEventIndex:
+    """
+    Índice ordenado de eventos (substitui a antiga ABB não balanceada).
+
+    Os eventos ficam em blocos ordenados de tamanho limitado, com uma lista
+    auxiliar com a maior chave de cada bloco (uma B-tree de um nível). Busca e
+    inserção fazem duas buscas binárias (O(log n)) mais um deslocamento dentro
+    de um único bloco, e nada é recursivo, então não há limite de profundidade
+    mesmo quando os eventos chegam já ordenados pelo timestamp.
+
+    A chave é a tupla (timestamp, id) e o payload um dict com tipo, lat, lon,
+    acel e dispositivo, mas cada bloco guarda os eventos em colunas
+    (EventColumns), com tipo e dispositivo no StringTable do índice e a
+    aceleração como número (codificar_acel). Os dicts só são montados na
+    leitura por items()/irange()/get(); slice_columns() copia uma faixa
+    direto das colunas, para o serializador JSON.
+    """
+
+    DEFAULT_LOAD = 512
+
+    def __init__(self, load=DEFAULT_LOAD):
+        self._load = load
+        self.limpar()
+
+    def limpar(self):
+        """Esvazia o índice, inclusive a tabela de textos."""
+        self._blocos = []  # EventColumns, cada um ordenado
+        self._maxes = []   # maior chave de cada bloco
+        self._len = 0
+        self.textos = StringTable()
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, key):
+        return self._locate(key) is not None
+
+    def _linha(self, key, data):
+        codigo = self.textos.codigo
+        acel, acel_formato = codificar_acel(data.get("acel"), self.textos)
+        return (key[0], key[1], float(data["lat"]), float(data["lon"]),
+                codigo(data["tipo"]), acel, acel_formato, codigo(data.get("dispositivo")))
+
+    def _payloads(self, bloco, inicio=0, fim=None):
+        textos = self.textos.textos
+        colunas = zip(bloco.ts[inicio:fim], bloco.ids[inicio:fim], bloco.lat[inicio:fim],
+                      bloco.lon[inicio:fim], bloco.tipo[inicio:fim], bloco.acel[inicio:fim],
+                      bloco.acel_formato[inicio:fim], bloco.dispositivo[inicio:fim])
+        for ts, evento_id, lat, lon, tipo, acel, acel_formato, dispositivo in colunas:
+            yield ((ts, evento_id),
+                   {"tipo": textos[tipo], "lat": lat, "lon": lon,
+                    "acel": texto_acel(acel, acel_formato, textos),
+                    "dispositivo": textos[dispositivo]})
+
+    def _locate(self, key):
+        """Retorna (bloco, posição) da chave, ou None se ela não existir."""
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return None
+        bloco = self._blocos[pos]
+        idx = bloco.position(key)
+        if idx == len(bloco) or bloco.chave(idx) != key:
+            return None
+        return pos, idx
 
     def insert(self, key, data):
-        """Insere um novo evento na ABB com base no timestamp (key)."""
-        if self.root is None:
-            self.root = Node(key, data)
+        """
+        Insere um novo evento com base na chave (timestamp, id).
+        Chaves repetidas são ignoradas, como na ABB original.
+        Retorna True se o evento foi inserido.
+        """
+        if not self._maxes:
+            bloco = EventColumns()
+            bloco.append(self._linha(key, data))
+            self._blocos.append(bloco)
+            self._maxes.append(key)
+            self._len = 1
+            return True
+
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            # Caso mais comum: evento mais novo que todos os outros.
+            pos -= 1
+            self._blocos[pos].append(self._linha(key, data))
+            self._maxes[pos] = key
+        else:
+            bloco = self._blocos[pos]
+            idx = bloco.position(key)
+            if bloco.chave(idx) == key:
+                return False
+            bloco.insert(idx, self._linha(key, data))
+
+        self._len += 1
+        if len(self._blocos[pos]) > 2 * self._load:
+            self._split(pos)
+        return True
+
+    def _split(self, pos):
+        """Divide um bloco cheio em dois, mantendo os blocos balanceados."""
+        bloco = self._blocos[pos]
+        self._blocos.insert(pos + 1, bloco.split_off(self._load))
+        self._maxes.insert(pos, bloco.chave(-1))
+
+    def bulk_load(self, items):
+        """
+        Carrega um fluxo de pares (chave, payload) já ordenado pela chave,
+        montando os blocos diretamente em O(n). Se o índice não estiver vazio
+        ou o fluxo sair de ordem, os eventos restantes são inseridos um a um.
+        Retorna o número de eventos inseridos.
+        """
+        it = iter(items)
+        if self._len:
+            return sum(1 for key, data in it if self.insert(key, data))
+
+        load = self._load
+        bloco = EventColumns()
+        last = None
+        inserted = 0
+        for key, payload in it:
+            if last is not None and key <= last:
+                if key == last:
+                    continue
+                self._flush_chunk(bloco)
+                self.insert(key, payload)
+                return inserted + 1 + sum(1 for k, d in it if self.insert(k, d))
+            bloco.append(self._linha(key, payload))
+            last = key
+            inserted += 1
+            if len(bloco) == load:
+                self._flush_chunk(bloco)
+                bloco = EventColumns()
+        self._flush_chunk(bloco)
+        return inserted
+
+    def load_columns(self, colunas, textos):
+        """
+        Substitui o conteúdo do índice por colunas já ordenadas por
+        (timestamp, id), sem chaves repetidas (a carga do snapshot).
+        `colunas` mapeia cada nome de EventColumns para um buffer contíguo do
+        mesmo tipo (um array NumPy, por exemplo) e os códigos de texto se
+        referem ao StringTable `textos`. Cada bloco é copiado das colunas por
+        fatias (frombytes), sem montar um payload por evento.
+        """
+        total = len(colunas["ts"])
+        blocos, maxes = [], []
+        for inicio in range(0, total, self._load):
+            bloco = EventColumns()
+            for nome in EventColumns.__slots__:
+                fatia = colunas[nome][inicio:inicio + self._load]
+                getattr(bloco, nome).frombytes(memoryview(fatia).cast("B"))
+            blocos.append(bloco)
+            maxes.append(bloco.chave(-1))
+        self._blocos, self._maxes, self._len, self.textos = blocos, maxes, total, textos
+
+    def merge(self, items):
+        """
+        Mescla um lote de pares (chave, payload) em qualquer ordem. O lote é
+        ordenado e a parte mais nova que tudo no índice (o caso normal na
+        ingestão) é anexada ao último bloco de uma vez; o resto é inserido
+        individualmente. Retorna o número de eventos inseridos.
+        """
+        lote = sorted(items, key=lambda item: item[0])
+        if not self._len:
+            return self.bulk_load(lote)
+
+        maior = self._maxes[-1]
+        corte = len(lote)
+        while corte and lote[corte - 1][0] > maior:
+            corte -= 1
+        inseridos = sum(1 for key, data in lote[:corte] if self.insert(key, data))
+
+        novos = 0
+        ultimo = self._blocos[-1]
+        for key, data in lote[corte:]:
+            if key == self._maxes[-1]:
+                continue
+            ultimo.append(self._linha(key, data))
+            self._maxes[-1] = key
+            novos += 1
+        self._len += novos
+        while len(self._blocos[-1]) > 2 * self._load:
+            self._split(len(self._blocos) - 1)
+        return inseridos + novos
+
+    def _flush_chunk(self, bloco):
+        if len(bloco):
+            self._blocos.append(bloco)
+            self._maxes.append(bloco.chave(-1))
+            self._len += len(bloco)
+
+    def get(self, key, default=None):
+        """Busca o payload de uma chave em O(log n)."""
+        loc = self._locate(key)
+        if loc is None:
+            return default
+        pos, idx = loc
+        bloco, textos = self._blocos[pos], self.textos.textos
+        return {"tipo": textos[bloco.tipo[idx]], "lat": bloco.lat[idx], "lon": bloco.lon[idx],
+                "acel": texto_acel(bloco.acel[idx], bloco.acel_formato[idx], textos),
+                "dispositivo": textos[bloco.dispositivo[idx]]}
+
+    def items(self):
+        """Percorre os eventos em ordem cronológica, sem recursão."""
+        for bloco in self._blocos:
+            yield from self._payloads(bloco)
+
+    def _fatias(self, min_key, max_key, exclusive_min):
+        """Gera (bloco, início, fim) não vazios cobrindo a faixa pedida."""
+        if not self._maxes:
+            return
+        if min_key is None:
+            pos, idx = 0, 0
         else:
-            self._insert_recursive(self.root, key, data)
-        
-
-    def _insert_recursive(self, node, key, data):
-        """Função auxiliar recursiva para inserção."""
-        if key < node.key:
-            if node.left is None:
-                node.left = Node(key, data)
-            else:
-                self._insert_recursive(node.left, key, data)
-        elif key > node.key:
-            if node.right is None:
-                node.right = Node(key, data)
-            else:
-                self._insert_recursive(node.right, key, data)
-
-    def inorder_traversal(self, node):
-        """
-        Percorre a árvore em ordem (Inorder) para retornar os eventos
-        em ordem cronológica.
-        """
-        res = []
-        if node:
-            res.extend(self.inorder_traversal(node.left))
-            
-            res.append({"key": node.key, "data": node.data})
-            
-            res.extend(self.inorder_traversal(node.right))
-        return res
+            busca = bisect_right if exclusive_min else bisect_left
+            pos = busca(self._maxes, min_key)
+            if pos == len(self._maxes):
+                return
+            idx = self._blocos[pos].position(min_key, direita=exclusive_min)
+
+        for pos in range(pos, len(self._blocos)):
+            bloco = self._blocos[pos]
+            if max_key is not None and self._maxes[pos] > max_key:
+                end = bloco.position(max_key, direita=True)
+                if end > idx:
+                    yield bloco, idx, end
+                return
+            yield bloco, idx, len(bloco)
+            idx = 0
+
+    def irange(self, min_key=None, max_key=None, exclusive_min=False):
+        """
+        Percorre em ordem os eventos com min_key <= chave <= max_key
+        (ou min_key < chave, se exclusive_min). Localizar o início custa
+        O(log n); depois a varredura é proporcional ao que for devolvido.
+        """
+        for bloco, inicio, fim in self._fatias(min_key, max_key, exclusive_min):
+            yield from self._payloads(bloco, inicio, fim)
+
+    def slice_columns(self, min_key=None, max_key=None, exclusive_min=False, limit=None):
+        """
+        Copia a mesma faixa de irange() (até `limit` eventos) para um
+        EventColumns, sem montar dicts. Retorna (colunas, tem_mais). A cópia
+        é independente do índice e pode ser lida depois de soltar o lock.
+        """
+        resultado = EventColumns()
+        for bloco, inicio, fim in self._fatias(min_key, max_key, exclusive_min):
+            if limit is not None:
+                falta = limit - len(resultado)
+                if falta <= 0:
+                    return resultado, True
+                if fim - inicio > falta:
+                    resultado.extend_from(bloco, inicio, inicio + falta)
+                    return resultado, True
+            resultado.extend_from(bloco, inicio, fim)
+        return resultado, False
+
+    def column_arrays(self, nomes, min_key=None, max_key=None):
+        """
+        Copia só as colunas `nomes` da faixa de irange() para um array
+        contíguo por coluna (lido com np.frombuffer, sem um objeto por
+        evento). Como em slice_columns(), a cópia vale depois de soltar o lock.
+        """
+        resultado = {nome: array(tipo) for nome, tipo in EventColumns.TIPOS if nome in nomes}
+        for bloco, inicio, fim in self._fatias(min_key, max_key, False):
+            inteiro = inicio == 0 and fim == len(bloco)
+            for nome, coluna in resultado.items():
+                origem = getattr(bloco, nome)
+                coluna.extend(origem if inteiro else origem[inicio:fim])
+        return resultado
+
+    def __iter__(self):
+        for bloco in self._blocos:
+            yield from zip(bloco.ts, bloco.ids)
 
     def get_all_events_sorted(self):
-        """Função wrapper para obter todos os eventos ordenados."""
-        return self.inorder_traversal(self.root)
\ No newline at end of file
+        """Retorna todos os eventos ordenados, no formato usado pela API."""
+        return [{"key": key, "data": data} for key, data in self.items()]
@@ -0,0 +1,99 @@
+import threading
+import time
+
+
+class EventChangeFeed:
+    """
+    Acompanha a cauda da tabela Evento pelo id para manter o índice em
+    memória de cada worker (gunicorn) coerente com o que os outros gravaram.
+
+    Guarda o maior id já aplicado e as lacunas abaixo dele: ids que ainda
+    não apareceram porque a transação de outro worker não terminou (em
+    Postgres a sequência não garante ordem de commit). Cada sincronização
+    busca só `id > ultimo_id` ou ids das lacunas, uma consulta pelo índice
+    da chave primária. Lacunas que nunca se preenchem (rollback, exclusão)
+    expiram depois de `validade_lacuna` segundos.
+
+    A mesma contabilidade serve de posição para os clientes do stream: o
+    que já foi entregue a um cliente é registrado numa instância própria.
+    """
+
+    MAX_LACUNAS = 10000
+
+    def __init__(self, intervalo=0.1, validade_lacuna=60.0):
+        self._intervalo = intervalo
+        self._validade = validade_lacuna
+        self._lock = threading.Lock()
+        self._proxima = 0.0
+        self.ultimo_id = 0
+        self._lacunas = {}   # id -> instante em que deixa de ser esperado
+
+    @property
+    def lacunas(self):
+        return list(self._lacunas)
+
+    def posicao(self):
+        """(ultimo_id, lacunas) lidos juntos: tudo até ultimo_id, menos as lacunas, já foi aplicado."""
+        with self._lock:
+            self._podar(time.monotonic())
+            return self.ultimo_id, sorted(self._lacunas)
+
+    def aplicado(self, evento_id):
+        """Indica se o id já foi registrado (e não é uma lacuna pendente)."""
+        with self._lock:
+            return evento_id <= self.ultimo_id and evento_id not in self._lacunas
+
+    def inicializar(self, ultimo_id, lacunas=(), agora=None):
+        """
+        Define o ponto de partida do feed após uma carga em massa (snapshot),
+        sem percorrer todos os ids carregados.
+        """
+        agora = time.monotonic() if agora is None else agora
+        with self._lock:
+            self.ultimo_id = ultimo_id
+            self._lacunas = dict.fromkeys(lacunas, agora + self._validade)
+            self._podar(agora)
+
+    def registrar(self, ids, agora=None):
+        """Marca ids como aplicados no índice local (gravação própria ou feed)."""
+        agora = time.monotonic() if agora is None else agora
+        with self._lock:
+            for evento_id in sorted(ids):
+                if evento_id > self.ultimo_id:
+                    expira = agora + self._validade
+                    primeiro = max(self.ultimo_id + 1, evento_id - self.MAX_LACUNAS)
+                    for faltante in range(primeiro, evento_id):
+                        self._lacunas[faltante] = expira
+                    self.ultimo_id = evento_id
+                else:
+                    self._lacunas.pop(evento_id, None)
+            self._podar(agora)
+
+    def _podar(self, agora):
+        vencidas = [i for i, expira in self._lacunas.items() if expira <= agora]
+        for evento_id in vencidas:
+            del self._lacunas[evento_id]
+        if len(self._lacunas) > self.MAX_LACUNAS:
+            for evento_id in sorted(self._lacunas)[:-self.MAX_LACUNAS]:
+                del self._lacunas[evento_id]
+
+    def sincronizar(self, buscar, aplicar, forcar=False):
+        """
+        Busca e aplica o que outros processos gravaram. `buscar(ultimo_id,
+        lacunas)` devolve as linhas novas e `aplicar(linhas)` as mescla em
+        memória e devolve os ids de todas as linhas recebidas. Respeita o
+        intervalo mínimo entre consultas, a menos que `forcar` seja verdadeiro.
+        """
+        agora = time.monotonic()
+        if not forcar and agora < self._proxima:
+            return 0
+        self._proxima = agora + self._intervalo
+        with self._lock:
+            self._podar(agora)
+            ultimo_id, lacunas = self.ultimo_id, list(self._lacunas)
+        linhas = buscar(ultimo_id, lacunas)
+        if not linhas:
+            return 0
+        ids = aplicar(linhas)
+        self.registrar(ids, agora)
+        return len(ids)
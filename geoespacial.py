@@ -0,0 +1,196 @@
+"""
+Índice espacial dos eventos: grade de células de `passo` graus.
+
+Cada célula guarda seus eventos em um bst.EventColumns (mesmo layout
+colunar do índice ordenado), então uma consulta só lê as células que
+cobrem a área pedida e filtra os candidatos com NumPy. Coordenadas
+antigas fora de [-90, 90] x [-180, 180] ficam nas células em que caírem; a
+grade não trata a volta na linha de data (antimeridiano).
+"""
+import math
+import threading
+
+import numpy as np
+
+from bst import ACEL_TEXTO, EventColumns, StringTable, codificar_acel
+
+RAIO_TERRA_METROS = 6_371_000.0
+METROS_POR_GRAU = math.pi * RAIO_TERRA_METROS / 180.0
+
+
+def distancias_metros(lat, lon, lats, lons):
+    """Distância (haversine) de um ponto a arrays de pontos, em metros."""
+    phi, phis = np.radians(lat), np.radians(lats)
+    dphi = phis - phi
+    dlambda = np.radians(lons - lon)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi) * np.cos(phis) * np.sin(dlambda / 2) ** 2
+    return 2 * RAIO_TERRA_METROS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex:
+    """
+    Grade de células -> eventos. `adicionar` recebe as linhas da ingestão e
+    `carregar` monta a grade inteira de uma vez a partir das colunas do
+    índice ordenado. O lock só cobre a cópia das células candidatas; a
+    filtragem e a ordenação das consultas acontecem fora dele.
+    """
+
+    def __init__(self, passo=0.01):
+        self.passo = passo
+        self.textos = StringTable()
+        self._celulas = {}
+        self._len = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._len
+
+    def _celula(self, lat, lon):
+        return (math.floor(lat / self.passo), math.floor(lon / self.passo))
+
+    def adicionar(self, linhas):
+        """Acrescenta linhas (id, timestamp, tipo, lat, lon, acel, dispositivo)."""
+        codigo = self.textos.codigo
+        with self._lock:
+            for evento_id, timestamp, tipo, lat, lon, acel, dispositivo in linhas:
+                chave = self._celula(lat, lon)
+                celula = self._celulas.get(chave)
+                if celula is None:
+                    celula = self._celulas[chave] = EventColumns()
+                valor, formato = codificar_acel(acel, self.textos)
+                celula.append((timestamp, evento_id, float(lat), float(lon),
+                               codigo(tipo), valor, formato, codigo(dispositivo)))
+                self._len += 1
+
+    def carregar(self, colunas, textos):
+        """
+        Substitui a grade pelos eventos de um EventColumns (por exemplo,
+        OrderedEventIndex.slice_columns()), cujos códigos vêm de `textos`.
+        Usado na inicialização, antes de o servidor atender consultas.
+        """
+        tabela, celulas_novas = StringTable(), {}
+        if not len(colunas):
+            with self._lock:
+                self.textos, self._celulas, self._len = tabela, celulas_novas, 0
+            return
+        # Traduz os códigos do índice de origem para a tabela da grade.
+        mapa = np.array([tabela.codigo(texto) for texto in textos.textos], dtype=np.uint32)
+        lat, lon = np.array(colunas.lat), np.array(colunas.lon)
+        i = np.floor(lat / self.passo).astype(np.int64)
+        j = np.floor(lon / self.passo).astype(np.int64)
+        ordem = np.lexsort((j, i))
+        origem = {
+            "ts": np.array(colunas.ts)[ordem], "ids": np.array(colunas.ids)[ordem],
+            "lat": lat[ordem], "lon": lon[ordem],
+            "tipo": mapa[np.array(colunas.tipo)[ordem]],
+            "acel": np.array(colunas.acel)[ordem],
+            "acel_formato": np.array(colunas.acel_formato)[ordem],
+            "dispositivo": mapa[np.array(colunas.dispositivo)[ordem]],
+        }
+        # Só as acelerações guardadas como texto têm código a traduzir.
+        texto = origem["acel_formato"] == ACEL_TEXTO
+        origem["acel"][texto] = mapa[origem["acel"][texto].astype(np.int64)]
+        i, j = i[ordem], j[ordem]
+        cortes = np.flatnonzero((np.diff(i) != 0) | (np.diff(j) != 0)) + 1
+        inicios = np.concatenate(([0], cortes)).tolist()
+        fins = np.concatenate((cortes, [len(ordem)])).tolist()
+        for inicio, fim in zip(inicios, fins):
+            celula = EventColumns()
+            for nome in EventColumns.__slots__:
+                getattr(celula, nome).frombytes(origem[nome][inicio:fim].tobytes())
+            celulas_novas[(int(i[inicio]), int(j[inicio]))] = celula
+        with self._lock:
+            self.textos, self._celulas, self._len = tabela, celulas_novas, len(ordem)
+
+    def _candidatos(self, lat_min, lat_max, lon_min, lon_max):
+        """Concatena (em arrays NumPy) os eventos das células que cobrem a área."""
+        i_min, j_min = self._celula(lat_min, lon_min)
+        i_max, j_max = self._celula(lat_max, lon_max)
+        with self._lock:
+            if (i_max - i_min + 1) * (j_max - j_min + 1) <= len(self._celulas):
+                celulas = (self._celulas.get((i, j))
+                           for i in range(i_min, i_max + 1) for j in range(j_min, j_max + 1))
+            else:
+                # Área maior que a parte ocupada da grade: percorre só as células com eventos.
+                celulas = (celula for (i, j), celula in self._celulas.items()
+                           if i_min <= i <= i_max and j_min <= j <= j_max)
+            celulas = [celula for celula in celulas if celula is not None]
+            return {
+                nome: np.concatenate([np.array(getattr(celula, nome)) for celula in celulas])
+                if celulas else np.array(getattr(EventColumns(), nome))
+                for nome in EventColumns.__slots__
+            }
+
+    def _filtrar(self, candidatos, mascara, since, until, tipo, dispositivo):
+        if since is not None:
+            mascara &= candidatos["ts"] >= since
+        if until is not None:
+            mascara &= candidatos["ts"] <= until
+        for nome, texto in (("tipo", tipo), ("dispositivo", dispositivo)):
+            if texto is not None:
+                codigo = self.textos.existente(texto)
+                if codigo is None:
+                    mascara[:] = False
+                else:
+                    mascara &= candidatos[nome] == codigo
+        return {nome: coluna[mascara] for nome, coluna in candidatos.items()}
+
+    def _na_caixa(self, lat_min, lat_max, lon_min, lon_max, since, until, tipo, dispositivo):
+        candidatos = self._candidatos(lat_min, lat_max, lon_min, lon_max)
+        mascara = ((candidatos["lat"] >= lat_min) & (candidatos["lat"] <= lat_max)
+                   & (candidatos["lon"] >= lon_min) & (candidatos["lon"] <= lon_max))
+        return self._filtrar(candidatos, mascara, since, until, tipo, dispositivo)
+
+    def caixa(self, lat_min, lat_max, lon_min, lon_max,
+              since=None, until=None, tipo=None, dispositivo=None):
+        """Eventos dentro do retângulo, em ordem de (timestamp, id)."""
+        eventos = self._na_caixa(lat_min, lat_max, lon_min, lon_max, since, until, tipo, dispositivo)
+        ordem = np.lexsort((eventos["ids"], eventos["ts"]))
+        return {nome: coluna[ordem] for nome, coluna in eventos.items()}
+
+    def raio(self, lat, lon, metros, since=None, until=None, tipo=None, dispositivo=None):
+        """
+        Eventos a até `metros` do ponto, do mais próximo ao mais distante.
+        Retorna (colunas, distâncias em metros).
+        """
+        dlat = metros / METROS_POR_GRAU
+        cos_lat = math.cos(math.radians(min(89.0, abs(lat) + dlat)))
+        dlon = min(180.0, metros / (METROS_POR_GRAU * cos_lat))
+        candidatos = self._candidatos(lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+        distancias = distancias_metros(lat, lon, candidatos["lat"], candidatos["lon"])
+        candidatos["distancia"] = distancias
+        eventos = self._filtrar(candidatos, distancias <= metros, since, until, tipo, dispositivo)
+        distancias = eventos.pop("distancia")
+        ordem = np.lexsort((eventos["ids"], eventos["ts"], distancias))
+        return {nome: coluna[ordem] for nome, coluna in eventos.items()}, distancias[ordem]
+
+    def agrupar(self, tamanho, lat_min=-90.0, lat_max=90.0, lon_min=-180.0, lon_max=180.0,
+                since=None, until=None, tipo=None, dispositivo=None):
+        """
+        Conta os eventos por célula de `tamanho` graus (independente do
+        passo da grade) dentro do retângulo. Retorna uma lista de
+        (i, j, total, lat média, lon média), com a célula i, j cobrindo
+        [i, i+1) x [j, j+1) vezes `tamanho`, da célula com mais
+        eventos para a com menos.
+        """
+        eventos = self._na_caixa(lat_min, lat_max, lon_min, lon_max, since, until, tipo, dispositivo)
+        if not len(eventos["ts"]):
+            return []
+        i = np.floor(eventos["lat"] / tamanho).astype(np.int64)
+        j = np.floor(eventos["lon"] / tamanho).astype(np.int64)
+        # Uma chave inteira por célula: np.unique em 1-D é bem mais rápido
+        # que sobre pares (axis=0).
+        i_min, j_min = i.min(), j.min()
+        largura = int(j.max() - j_min) + 1
+        celulas, grupo, totais = np.unique((i - i_min) * largura + (j - j_min),
+                                           return_inverse=True, return_counts=True)
+        lat_media = np.bincount(grupo, weights=eventos["lat"]) / totais
+        lon_media = np.bincount(grupo, weights=eventos["lon"]) / totais
+        ordem = np.lexsort((celulas, -totais))
+        i_celula = celulas // largura + i_min
+        j_celula = celulas % largura + j_min
+        return [
+            (int(i_celula[k]), int(j_celula[k]), int(totais[k]),
+             float(lat_media[k]), float(lon_media[k]))
+            for k in ordem.tolist()
+        ]
@@ -0,0 +1,26 @@
+"""
+Configuração do gunicorn (lida automaticamente de ./gunicorn.conf.py ao
+rodar `gunicorn app:app` na raiz do projeto).
+
+Cada cliente de /api/eventos/stream (SSE) ocupa uma thread do worker
+enquanto estiver conectado. Com o worker padrão (sync), um único inscrito
+prenderia o worker inteiro e as outras requisições ficariam na fila; por
+isso o worker aqui é gthread, com muitas threads. Threads por worker x
+workers é o teto de inscritos simultâneos (somados às requisições comuns
+em andamento): acima disso, as conexões novas esperam uma thread livre.
+
+Variáveis de ambiente:
+    WEB_CONCURRENCY   número de workers (padrão 2)
+    GUNICORN_THREADS  threads por worker (padrão 256)
+"""
+import os
+
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "256"))
+# No gthread, é o máximo de conexões abertas por worker (inclusive ociosas
+# em keep-alive); precisa ficar acima do número de threads.
+worker_connections = max(1000, threads * 2)
+# Carrega o índice uma vez no master; os workers herdam a memória no fork
+# e se mantêm atualizados pelo feed do DB.
+preload_app = True
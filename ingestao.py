@@ -0,0 +1,108 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FuturoExpirado
+
+
+class GroupCommitWriter:
+    """
+    Agrupa gravações concorrentes em uma única transação (group commit).
+
+    Cada requisição entrega seu registro com submit() e espera o Future. Uma
+    thread gravadora pega o primeiro registro da fila, espera até `janela_ms`
+    por outros (no máximo `max_lote`) e grava todos de uma vez com a função
+    `gravar`, que recebe a lista de registros e devolve a lista de ids.
+    Assim uma rajada de eventos custa um commit (um fsync) por lote, e não
+    um por evento.
+
+    `gravar` só pode levantar exceção se nada foi gravado: nesse caso o lote
+    é refeito registro a registro. Falhas depois do commit devem ser tratadas
+    dentro dela, senão os registros já gravados seriam gravados de novo.
+    """
+
+    def __init__(self, app, gravar, janela_ms=5, max_lote=500):
+        self._app = app
+        self._gravar = gravar
+        self._janela = janela_ms / 1000.0
+        self._max_lote = max_lote
+        self._fila = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def ativo(self):
+        """Com janela zero o group commit fica desligado."""
+        return self._janela > 0
+
+    def submit(self, registro):
+        """Enfileira um registro e retorna um Future com o id gravado."""
+        self._garantir_thread()
+        futuro = Future()
+        self._fila.put((registro, futuro))
+        return futuro
+
+    def gravar(self, registro, timeout=None):
+        """
+        Enfileira o registro e espera o id. Se o prazo vencer antes de a
+        thread gravadora pegar o registro, ele sai da fila e sobe TimeoutError
+        (nada foi gravado); se a gravação já começou, espera o resultado dela.
+        """
+        futuro = self.submit(registro)
+        try:
+            return futuro.result(timeout=timeout)
+        except FuturoExpirado:
+            if futuro.cancel():
+                raise TimeoutError("registro não gravado: prazo esgotado na fila") from None
+            return futuro.result()
+
+    def _garantir_thread(self):
+        # A thread é criada sob demanda e recriada após um fork (workers do
+        # gunicorn), já que threads não sobrevivem ao fork.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._fila = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._loop, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def _coletar_lote(self):
+        lote = [self._fila.get()]
+        prazo = time.monotonic() + self._janela
+        while len(lote) < self._max_lote:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _loop(self):
+        while True:
+            # Registros cancelados por prazo esgotado ficam de fora do lote.
+            lote = [item for item in self._coletar_lote() if item[1].set_running_or_notify_cancel()]
+            if not lote:
+                continue
+            with self._app.app_context():
+                self._processar(lote)
+
+    def _processar(self, lote):
+        try:
+            ids = self._gravar([registro for registro, _ in lote])
+        except Exception as e:
+            if len(lote) == 1:
+                lote[0][1].set_exception(e)
+                return
+            # Um registro ruim não deve derrubar o lote inteiro: regrava um a um
+            # para que só a requisição culpada receba o erro.
+            for item in lote:
+                self._processar([item])
+            return
+        for (_, futuro), evento_id in zip(lote, ids):
+            futuro.set_result(evento_id)
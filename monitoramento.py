@@ -0,0 +1,271 @@
+"""
+Instrumentação do servidor: métricas no formato texto do Prometheus,
+logging que não bloqueia o caminho das requisições e perfil (cProfile)
+opcional por requisição.
+
+As métricas são por processo: com vários workers do gunicorn, cada um
+expõe as suas em /metrics.
+"""
+import atexit
+import cProfile
+import io
+import logging
+import logging.handlers
+import math
+import os
+import pstats
+import queue
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Limites (em segundos) dos histogramas de latência.
+LIMITES_PADRAO = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                  0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _valor(numero):
+    if isinstance(numero, float):
+        if math.isinf(numero):
+            return "+Inf" if numero > 0 else "-Inf"
+        return repr(numero)
+    return str(numero)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _rotulos(nomes, valores, extra=()):
+    pares = list(zip(nomes, valores)) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + "}"
+
+
+class Counter:
+    """Contador monotônico, com rótulos opcionais."""
+
+    tipo = "counter"
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome, self.ajuda, self.rotulos = nome, ajuda, tuple(rotulos)
+        # Sem rótulos, a série existe (zerada) desde o início.
+        self._valores = {} if self.rotulos else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, **rotulos):
+        chave = tuple(str(rotulos[nome]) for nome in self.rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def linhas(self):
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for chave, valor in valores:
+            yield f"{self.nome}{_rotulos(self.rotulos, chave)} {_valor(valor)}"
+
+
+class Gauge:
+    """Valor lido na hora da exportação, por uma função sem argumentos."""
+
+    def __init__(self, nome, ajuda, funcao, tipo="gauge"):
+        self.nome, self.ajuda, self.tipo = nome, ajuda, tipo
+        self._funcao = funcao
+
+    def linhas(self):
+        yield f"{self.nome} {_valor(self._funcao())}"
+
+
+class Histogram:
+    """
+    Histograma de limites fixos (cumulativo na exportação, como o
+    Prometheus espera). `time()` mede um bloco com time.perf_counter().
+    """
+
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, rotulos=(), limites=LIMITES_PADRAO):
+        self.nome, self.ajuda, self.rotulos = nome, ajuda, tuple(rotulos)
+        self.limites = tuple(sorted(limites))
+        self._series = {}  # rótulos -> [contagens por faixa..., soma]
+        if not self.rotulos:
+            self._series[()] = [0] * (len(self.limites) + 1) + [0.0]
+        self._lock = threading.Lock()
+
+    def observe(self, valor, **rotulos):
+        chave = tuple(str(rotulos[nome]) for nome in self.rotulos)
+        faixa = bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [0] * (len(self.limites) + 1) + [0.0]
+            serie[faixa] += 1
+            serie[-1] += valor
+
+    @contextmanager
+    def time(self, **rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **rotulos)
+
+    def linhas(self):
+        with self._lock:
+            series = sorted((chave, list(serie)) for chave, serie in self._series.items())
+        for chave, serie in series:
+            acumulado = 0
+            for limite, contagem in zip(self.limites + (math.inf,), serie[:-1]):
+                acumulado += contagem
+                yield (f"{self.nome}_bucket"
+                       f"{_rotulos(self.rotulos, chave, [('le', _valor(float(limite)))])} {acumulado}")
+            yield f"{self.nome}_sum{_rotulos(self.rotulos, chave)} {_valor(serie[-1])}"
+            yield f"{self.nome}_count{_rotulos(self.rotulos, chave)} {acumulado}"
+
+
+class MetricsRegistry:
+    """Conjunto de métricas do processo, exportadas juntas por `exportar()`."""
+
+    def __init__(self):
+        self._metricas = []
+
+    def _registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def counter(self, nome, ajuda, rotulos=()):
+        return self._registrar(Counter(nome, ajuda, rotulos))
+
+    def histogram(self, nome, ajuda, rotulos=(), limites=LIMITES_PADRAO):
+        return self._registrar(Histogram(nome, ajuda, rotulos, limites))
+
+    def gauge(self, nome, ajuda, funcao, tipo="gauge"):
+        return self._registrar(Gauge(nome, ajuda, funcao, tipo))
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+        saida = []
+        for metrica in self._metricas:
+            saida.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+            saida.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            saida.extend(metrica.linhas())
+        return "\n".join(saida) + "\n"
+
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """
+    Handler de logging que não bloqueia quem loga: o registro vai para uma
+    fila limitada e uma thread o formata e escreve no stream em lotes (um
+    write e um flush por lote). Com a fila cheia, o registro é descartado e
+    contado em `descartados`, em vez de segurar a requisição.
+    """
+
+    def __init__(self, stream, capacidade=10000, max_lote=500):
+        super().__init__(queue.Queue(capacidade))
+        self.stream = stream
+        self.capacidade = capacidade
+        self.max_lote = max_lote
+        self.descartados = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        # Escreve o que ainda estiver na fila quando o processo terminar.
+        atexit.register(self.flush)
+
+    def prepare(self, record):
+        # Só resolve a mensagem (os argumentos podem mudar depois); a
+        # formatação completa fica para a thread escritora.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        self._garantir_thread()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+    def _garantir_thread(self):
+        # Mesmo esquema do GroupCommitWriter: criada sob demanda e recriada
+        # após um fork, com uma fila nova.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self.queue = queue.Queue(self.capacidade)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name="log", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            registros = [self.queue.get()]
+            try:
+                while len(registros) < self.max_lote:
+                    registros.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self.stream.write("".join(self.format(registro) + "\n" for registro in registros))
+                self.stream.flush()
+            except Exception:
+                pass
+            finally:
+                for _ in registros:
+                    self.queue.task_done()
+
+    def flush(self, timeout=2.0):
+        """Espera (até `timeout`) a thread escrever o que está na fila."""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        prazo = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < prazo:
+            time.sleep(0.01)
+
+
+class RequestProfiler:
+    """
+    Perfil (cProfile) opcional por requisição. Modos:
+      ""          desligado
+      "cabecalho" só requisições com o cabeçalho X-Perfil: 1
+      "todas"     todas as requisições
+    Cada perfil é gravado em `pasta` (abre com pstats ou snakeviz) e as
+    funções mais caras vão para o log.
+    """
+
+    CABECALHO = "X-Perfil"
+
+    def __init__(self, modo, pasta, linhas=20):
+        if modo not in ("", "cabecalho", "todas"):
+            raise ValueError(f"modo de perfil inválido: {modo!r}")
+        self.modo, self.pasta, self.linhas = modo, pasta, linhas
+
+    def deve_perfilar(self, cabecalhos):
+        if self.modo == "todas":
+            return True
+        return self.modo == "cabecalho" and cabecalhos.get(self.CABECALHO) == "1"
+
+    def iniciar(self):
+        """Retorna um cProfile.Profile ativo, ou None se outro já estiver ativo."""
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            # Só um profiler por vez (Python 3.12+): requisições simultâneas
+            # seguem sem perfil.
+            return None
+        return perfil
+
+    def concluir(self, perfil, rota):
+        """Para o perfil, grava o arquivo e retorna (nome do arquivo, resumo)."""
+        perfil.disable()
+        os.makedirs(self.pasta, exist_ok=True)
+        sufixo = "".join(c if c.isalnum() else "_" for c in rota.strip("/")) or "raiz"
+        nome = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{sufixo}.prof"
+        perfil.dump_stats(os.path.join(self.pasta, nome))
+        resumo = io.StringIO()
+        pstats.Stats(perfil, stream=resumo).sort_stats("cumulative").print_stats(self.linhas)
+        return nome, resumo.getvalue()
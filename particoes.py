@@ -0,0 +1,115 @@
+import threading
+import time
+
+from bst import OrderedEventIndex
+from risco import RiskAggregates
+
+
+class Partition:
+    """Índice e agregados de risco de um único dispositivo/paciente."""
+
+    def __init__(self, dispositivo):
+        self.dispositivo = dispositivo
+        self.indice = OrderedEventIndex()
+        self.agregados = RiskAggregates()
+        self.lock = threading.Lock()
+        self.ultimo_acesso = time.monotonic()
+
+    def __len__(self):
+        return len(self.indice)
+
+    def aplicar(self, entradas):
+        """Mescla (chave, payload) novos; ignora os que já estão no índice."""
+        with self.lock:
+            for chave, payload in entradas:
+                if self.indice.insert(chave, payload):
+                    self.agregados.add(chave[0], payload["tipo"])
+
+
+class PartitionManager:
+    """
+    Partições por dispositivo, carregadas sob demanda.
+
+    A primeira consulta de um dispositivo chama `carregar(particao)`, que lê
+    só as linhas dele (índice composto dispositivo, timestamp). Dispositivos
+    para os quais `conhecido(dispositivo)` é falso recebem uma partição
+    vazia, que não é guardada nem carregada. A cada `obter`, partições
+    ociosas há mais de `ociosidade` segundos são descartadas, e as menos
+    usadas também, enquanto houver mais de `max_particoes` partições ou o
+    total de eventos nelas passar de `max_eventos`.
+
+    O limite vale só para as cópias mantidas pelas partições: o índice global
+    e o índice geoespacial continuam com todos os eventos.
+    """
+
+    def __init__(self, carregar, conhecido=None, max_eventos=1_000_000,
+                 max_particoes=1000, ociosidade=600.0):
+        self._carregar = carregar
+        self._conhecido = conhecido
+        self._max_eventos = max_eventos
+        self._max_particoes = max_particoes
+        self._ociosidade = ociosidade
+        self._lock = threading.Lock()
+        self._particoes = {}
+
+    def __len__(self):
+        return len(self._particoes)
+
+    def total_eventos(self):
+        with self._lock:
+            return sum(len(particao) for particao in self._particoes.values())
+
+    def obter(self, dispositivo):
+        """Retorna a partição do dispositivo, carregando-a se preciso."""
+        if self._conhecido is not None and not self._conhecido(dispositivo):
+            return Partition(dispositivo)
+        with self._lock:
+            particao = self._particoes.get(dispositivo)
+            carregar = particao is None
+            if carregar:
+                particao = Partition(dispositivo)
+                # Segura o lock da partição durante a carga: eventos novos do
+                # dispositivo esperam e entram depois, sem se perder.
+                particao.lock.acquire()
+                self._particoes[dispositivo] = particao
+            particao.ultimo_acesso = time.monotonic()
+
+        if carregar:
+            try:
+                self._carregar(particao)
+            except Exception:
+                with self._lock:
+                    self._particoes.pop(dispositivo, None)
+                raise
+            finally:
+                particao.lock.release()
+        self._despejar(manter=particao)
+        return particao
+
+    def aplicar(self, dispositivo, entradas):
+        """Repassa eventos novos à partição, se ela estiver carregada."""
+        with self._lock:
+            particao = self._particoes.get(dispositivo)
+        if particao is not None:
+            particao.aplicar(entradas)
+
+    def _despejar(self, manter):
+        agora = time.monotonic()
+        with self._lock:
+            for dispositivo, particao in list(self._particoes.items()):
+                if particao is not manter and agora - particao.ultimo_acesso > self._ociosidade:
+                    del self._particoes[dispositivo]
+
+            total = sum(len(particao) for particao in self._particoes.values())
+            def dentro_dos_limites():
+                return total <= self._max_eventos and len(self._particoes) <= self._max_particoes
+            if dentro_dos_limites():
+                return
+            por_uso = sorted(self._particoes.values(), key=lambda p: p.ultimo_acesso)
+            for particao in por_uso:
+                if dentro_dos_limites():
+                    break
+                if particao is manter:
+                    continue
+                del self._particoes[particao.dispositivo]
+                total -= len(particao)
@@ -0,0 +1,182 @@
+import heapq
+import threading
+import time
+from datetime import datetime
+
+import pytz
+
+FUSO_HORARIO_BR = pytz.timezone('America/Sao_Paulo')
+
+HORA_INICIO_NOITE = 22
+HORA_FIM_NOITE = 6
+JANELA_RECENTE_SEGUNDOS = 7 * 24 * 3600
+
+
+def eh_noturno(timestamp):
+    """Indica se o timestamp cai entre 22h e 06h no horário de Brasília."""
+    hora = datetime.fromtimestamp(timestamp, FUSO_HORARIO_BR).hour
+    return hora >= HORA_INICIO_NOITE or hora < HORA_FIM_NOITE
+
+
+class RiskAggregates:
+    """
+    Agregados da análise de risco mantidos incrementalmente.
+
+    Cada evento é contabilizado uma única vez, ao ser gravado (ou carregado
+    na inicialização). A janela dos últimos 7 dias usa baldes de um segundo
+    guardados em um heap: os baldes que saem da janela são descartados na
+    consulta, então o custo é O(1) amortizado e a contagem é exata.
+    """
+
+    def __init__(self, janela=JANELA_RECENTE_SEGUNDOS):
+        self._janela = janela
+        self._lock = threading.Lock()
+        self.limpar()
+
+    def limpar(self):
+        """Zera todas as contagens."""
+        with self._lock:
+            self.total = 0
+            self.noturnos = 0
+            self.quedas = 0
+            self.panicos = 0
+            self._recentes = 0
+            self._baldes = {}        # timestamp -> quantidade de eventos
+            self._expiracao = []     # heap com os timestamps dos baldes
+
+    def add(self, timestamp, tipo, agora=None):
+        """Contabiliza um evento nos agregados."""
+        noturno = eh_noturno(timestamp)
+        agora = time.time() if agora is None else agora
+        with self._lock:
+            self.total += 1
+            if noturno:
+                self.noturnos += 1
+            if tipo == 'queda':
+                self.quedas += 1
+            elif tipo == 'panico':
+                self.panicos += 1
+            if timestamp >= int(agora - self._janela):
+                if timestamp in self._baldes:
+                    self._baldes[timestamp] += 1
+                else:
+                    self._baldes[timestamp] = 1
+                    heapq.heappush(self._expiracao, timestamp)
+                self._recentes += 1
+
+    def add_contagens(self, contagens, baldes_recentes, agora=None):
+        """
+        Soma contagens já calculadas em massa (carga do snapshot). Os baldes
+        recentes são pares (timestamp, quantidade).
+        """
+        agora = time.time() if agora is None else agora
+        limite = int(agora - self._janela)
+        with self._lock:
+            self.total += contagens["total_eventos"]
+            self.noturnos += contagens["eventos_noturnos"]
+            self.quedas += contagens["total_quedas"]
+            self.panicos += contagens["total_panicos"]
+            for timestamp, quantidade in baldes_recentes:
+                if timestamp < limite:
+                    continue
+                if timestamp in self._baldes:
+                    self._baldes[timestamp] += quantidade
+                else:
+                    self._baldes[timestamp] = quantidade
+                    heapq.heappush(self._expiracao, timestamp)
+                self._recentes += quantidade
+
+    def _expirar(self, limite):
+        while self._expiracao and self._expiracao[0] < limite:
+            self._recentes -= self._baldes.pop(heapq.heappop(self._expiracao))
+
+    def snapshot(self, agora=None):
+        """Retorna as contagens usadas pelas heurísticas de risco."""
+        agora = time.time() if agora is None else agora
+        with self._lock:
+            self._expirar(int(agora - self._janela))
+            return {
+                "total_eventos": self.total,
+                "eventos_noturnos": self.noturnos,
+                "eventos_recentes": self._recentes,
+                "total_quedas": self.quedas,
+                "total_panicos": self.panicos,
+            }
+
+
+def contagens_por_varredura(eventos, agora=None):
+    """
+    Calcula as mesmas contagens de RiskAggregates percorrendo todos os
+    eventos (pares timestamp, tipo). É o caminho antigo, mantido para a
+    verificação de consistência.
+    """
+    agora = time.time() if agora is None else agora
+    limite = int(agora - JANELA_RECENTE_SEGUNDOS)
+    contagens = {
+        "total_eventos": 0,
+        "eventos_noturnos": 0,
+        "eventos_recentes": 0,
+        "total_quedas": 0,
+        "total_panicos": 0,
+    }
+    for timestamp, tipo in eventos:
+        contagens["total_eventos"] += 1
+        if eh_noturno(timestamp):
+            contagens["eventos_noturnos"] += 1
+        if timestamp >= limite:
+            contagens["eventos_recentes"] += 1
+        if tipo == 'queda':
+            contagens["total_quedas"] += 1
+        elif tipo == 'panico':
+            contagens["total_panicos"] += 1
+    return contagens
+
+
+def gerar_alertas(contagens):
+    """Aplica as regras de heurística sobre as contagens agregadas."""
+    if not contagens["total_eventos"]:
+        return ["Não há dados suficientes para análise."]
+
+    eventos_noturnos = contagens["eventos_noturnos"]
+    eventos_recentes = contagens["eventos_recentes"]
+    total_quedas = contagens["total_quedas"]
+    total_panicos = contagens["total_panicos"]
+
+    lista_de_alertas = []
+
+    if eventos_noturnos > 0:
+        alerta = (
+            f"Detectamos {eventos_noturnos} evento(s) "
+            f"ocorrendo durante a noite (22h-06h). "
+            "Isso pode indicar confusão noturna (sundowning) ou risco de queda no escuro."
+        )
+        lista_de_alertas.append({"nivel": "alto", "texto": alerta})
+
+    if eventos_recentes > 2:
+        alerta = (
+            f"A frequência de eventos aumentou, "
+            f"com {eventos_recentes} alertas registrados apenas nos últimos 7 dias. "
+            "Recomenda-se observação."
+        )
+        lista_de_alertas.append({"nivel": "medio", "texto": alerta})
+    elif eventos_recentes > 0:
+        alerta = (
+            f"{eventos_recentes} evento(s) "
+            f"registrado(s) nos últimos 7 dias."
+        )
+        lista_de_alertas.append({"nivel": "info", "texto": alerta})
+
+    if total_quedas > total_panicos and total_quedas > 0:
+        alerta = (
+            f"O paciente registrou mais quedas ({total_quedas}) "
+            f"do que botões de pânico ({total_panicos}). "
+            "Isso pode indicar uma dificuldade de locomoção."
+        )
+        lista_de_alertas.append({"nivel": "info", "texto": alerta})
+
+    if not lista_de_alertas:
+        lista_de_alertas.append({
+            "nivel": "info",
+            "texto": "Nenhum padrão de risco óbvio detectado nos dados atuais. Continue monitorando."
+        })
+    return lista_de_alertas
@@ -0,0 +1,122 @@
+"""
+Caminho colunar (NumPy) para as heurísticas de risco.
+
+Usado em relatórios de janelas longas: as colunas tipadas do índice em
+memória (timestamp e código do tipo) viram arrays NumPy sem passar por um
+objeto por linha, e as contagens saem de operações vetorizadas, em vez de um
+objeto ORM e um datetime localizado por linha como na varredura original.
+"""
+from datetime import datetime
+
+import numpy as np
+
+from risco import (
+    FUSO_HORARIO_BR,
+    HORA_FIM_NOITE,
+    HORA_INICIO_NOITE,
+    JANELA_RECENTE_SEGUNDOS,
+)
+
+SEGUNDOS_POR_DIA = 86400
+
+
+def rotulos_de_tipo(textos):
+    """
+    Array indexado pelo código de texto do índice: o próprio tipo para
+    "queda" e "panico", vazio para o resto (só esses dois contam nas regras).
+    """
+    return np.array([texto if texto in ('queda', 'panico') else '' for texto in textos])
+
+
+def carregar_colunas(colunas, textos, dispositivo=None):
+    """
+    Converte as colunas `ts`, `tipo` e `dispositivo` copiadas do índice
+    (OrderedEventIndex.column_arrays) no formato de analisar_colunas().
+    `textos` é a lista de textos do StringTable do índice; com
+    `dispositivo` (um código dessa tabela), fica só com os eventos dele.
+    """
+    timestamps = np.frombuffer(colunas["ts"], dtype=np.int64)
+    tipos = np.frombuffer(colunas["tipo"], dtype=np.uint32)
+    if dispositivo is not None:
+        do_dispositivo = np.frombuffer(colunas["dispositivo"], dtype=np.uint32) == dispositivo
+        timestamps, tipos = timestamps[do_dispositivo], tipos[do_dispositivo]
+    return {"timestamp": timestamps, "tipo": rotulos_de_tipo(textos)[tipos]}
+
+
+def _offset_utc(timestamp, fuso):
+    return int(datetime.fromtimestamp(int(timestamp), fuso).utcoffset().total_seconds())
+
+
+def tabela_de_transicoes(inicio, fim, fuso=FUSO_HORARIO_BR):
+    """
+    Descobre os instantes em que o offset UTC do fuso muda (horário de verão)
+    entre inicio e fim. Consulta o fuso uma vez por dia do intervalo e faz uma
+    busca binária dentro do dia em que houve troca. Retorna dois arrays:
+    o início de cada trecho e o offset (em segundos) válido nele.
+    """
+    dia = int(inicio) - int(inicio) % SEGUNDOS_POR_DIA
+    pontos = [dia]
+    offsets = [_offset_utc(dia, fuso)]
+    while dia <= fim:
+        proximo = dia + SEGUNDOS_POR_DIA
+        offset = _offset_utc(proximo, fuso)
+        if offset != offsets[-1]:
+            antes, depois = dia, proximo
+            while depois - antes > 1:
+                meio = (antes + depois) // 2
+                if _offset_utc(meio, fuso) == offsets[-1]:
+                    antes = meio
+                else:
+                    depois = meio
+            pontos.append(depois)
+            offsets.append(offset)
+        dia = proximo
+    return np.array(pontos, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+
+def horas_locais(timestamps, fuso=FUSO_HORARIO_BR):
+    """Hora do dia (0-23) de cada timestamp no fuso, sem datetime por linha."""
+    if timestamps.size == 0:
+        return np.empty(0, dtype=np.int64)
+    pontos, offsets = tabela_de_transicoes(timestamps.min(), timestamps.max(), fuso)
+    trecho = np.searchsorted(pontos, timestamps, side='right') - 1
+    locais = timestamps + offsets[trecho]
+    return (locais // 3600) % 24
+
+
+def analisar_colunas(colunas, agora, dias=None):
+    """
+    Calcula as contagens de risco (mesmo formato de RiskAggregates.snapshot)
+    e o histograma de eventos por hora do dia. Com `dias`, considera apenas
+    os eventos dessa janela.
+    """
+    timestamps = colunas["timestamp"]
+    tipos = colunas["tipo"]
+    if dias is not None:
+        na_janela = timestamps >= int(agora - dias * SEGUNDOS_POR_DIA)
+        timestamps = timestamps[na_janela]
+        tipos = tipos[na_janela]
+
+    horas = horas_locais(timestamps)
+    noturnos = (horas >= HORA_INICIO_NOITE) | (horas < HORA_FIM_NOITE)
+    contagens = {
+        "total_eventos": int(timestamps.size),
+        "eventos_noturnos": int(np.count_nonzero(noturnos)),
+        "eventos_recentes": int(np.count_nonzero(
+            timestamps >= int(agora - JANELA_RECENTE_SEGUNDOS))),
+        "total_quedas": int(np.count_nonzero(tipos == 'queda')),
+        "total_panicos": int(np.count_nonzero(tipos == 'panico')),
+    }
+    histograma = np.bincount(horas, minlength=24).tolist()
+    return contagens, histograma
+
+
+def semear_agregados(agregados, timestamps, tipos, agora):
+    """
+    Alimenta um RiskAggregates com colunas inteiras de uma vez (usado na
+    carga do snapshot), sem localizar um datetime por evento.
+    """
+    contagens, _ = analisar_colunas({"timestamp": timestamps, "tipo": tipos}, agora)
+    recentes = timestamps[timestamps >= int(agora - JANELA_RECENTE_SEGUNDOS)]
+    valores, quantidades = np.unique(recentes, return_counts=True)
+    agregados.add_contagens(contagens, zip(valores.tolist(), quantidades.tolist()), agora)
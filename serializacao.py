@@ -0,0 +1,37 @@
+"""
+Serialização JSON dos eventos direto das colunas do índice (bst.EventColumns),
+sem montar um dict por evento nem passar pelo json.dumps genérico.
+"""
+from bst import ACEL_NULO, ACEL_NUMERO, MODELOS_ACEL
+
+# Mesmo formato de app.serializar_evento(), com as chaves em ordem
+# alfabética e sem espaços, como o jsonify do Flask produz.
+MODELO_EVENTO = ('{"data":{"acel":%s,"dispositivo":%s,"lat":%r,"lon":%r,"tipo":%s},'
+                 '"id":%d,"key":%d}')
+
+# Forma JSON de cada formato da coluna acel_formato: nulo, texto (código no
+# StringTable) e os modelos numéricos, cujo texto só tem dígitos, sinal,
+# ponto e "g" e dispensa escape.
+MODELOS_ACEL_JSON = ("null", None) + tuple('"%s"' % modelo for modelo in MODELOS_ACEL)
+
+
+def eventos_json(colunas, textos, lote=1000):
+    """
+    Gera o conteúdo de um array JSON de eventos (sem os colchetes), em
+    partes de até `lote` eventos. `textos` é o StringTable do índice de onde
+    as colunas vieram; os textos já ficam lá na forma JSON.
+    """
+    js, modelos = textos.json, MODELOS_ACEL_JSON
+    for inicio in range(0, len(colunas), lote):
+        fim = inicio + lote
+        linhas = zip(colunas.ts[inicio:fim], colunas.ids[inicio:fim],
+                     colunas.lat[inicio:fim], colunas.lon[inicio:fim],
+                     colunas.tipo[inicio:fim], colunas.acel[inicio:fim],
+                     colunas.acel_formato[inicio:fim], colunas.dispositivo[inicio:fim])
+        parte = ",".join([
+            MODELO_EVENTO % (modelos[acel_formato] % acel if acel_formato >= ACEL_NUMERO
+                             else js[int(acel)] if acel_formato != ACEL_NULO else "null",
+                             js[dispositivo], lat, lon, js[tipo], evento_id, ts)
+            for ts, evento_id, lat, lon, tipo, acel, acel_formato, dispositivo in linhas
+        ])
+        yield ("," + parte) if inicio else parte
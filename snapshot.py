@@ -0,0 +1,334 @@
+"""
+Snapshot binário do índice em memória + log de eventos (WAL) desde o snapshot.
+
+O snapshot guarda o índice no mesmo layout colunar de bst.EventColumns: uma
+coluna inteira depois da outra (timestamps, ids, lat, lon, os códigos dos
+textos e a aceleração codificada) e, no fim, a tabela de textos em JSON. A
+leitura mapeia o arquivo (mmap) e entrega as colunas como arrays NumPy, que
+viram os blocos do índice sem passar por um objeto por evento.
+
+O log recebe um lote a cada gravação: um cabeçalho com a quantidade de
+eventos, o tamanho e o CRC32 do corpo, e então cada evento com os campos
+fixos seguidos dos textos em UTF-8, só com os bytes usados. Na leitura os
+eventos viram um array NumPy estruturado (REGISTRO). O DB continua sendo a
+fonte da verdade: se os arquivos faltarem, estiverem corrompidos ou não
+baterem com o DB, a inicialização volta a carregar do DB.
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+from bst import ACEL_TEXTO, codificar_acel
+
+MAGICO = b"CUIDASN1"
+# magico, versão, quantidade de eventos, maior id do DB coberto, bytes da tabela de textos
+CABECALHO = struct.Struct("<8sIIqQ")
+VERSAO = 6
+
+# Colunas do snapshot, na ordem em que aparecem no arquivo (mesmos nomes e
+# tipos de bst.EventColumns).
+COLUNAS = (
+    ("ts", "<i8"),
+    ("ids", "<i8"),
+    ("lat", "<f8"),
+    ("lon", "<f8"),
+    ("tipo", "<u4"),
+    ("acel", "<f8"),
+    ("acel_formato", "u1"),
+    ("dispositivo", "<u4"),
+)
+
+# Campos de texto do log, na ordem dos bits de `nulos` (bit ligado = NULL
+# no DB, para não confundir com o texto vazio).
+TEXTOS = ("tipo", "acel", "dispositivo")
+
+# Lote do log: marca, quantidade de eventos, bytes do corpo e CRC32 do corpo.
+MARCA_LOTE = b"CUIDALT1"
+LOTE = struct.Struct("<8sIII")
+# Evento no corpo do lote: id, timestamp, lat, lon, nulos e o tamanho em
+# bytes de cada texto, que vêm logo depois, na ordem de TEXTOS.
+EVENTO = struct.Struct("<qqddBHHH")
+MAX_BYTES_TEXTO = 0xFFFF
+
+# Eventos lidos do log, um por linha, com os textos já decodificados.
+REGISTRO = np.dtype([
+    ("id", "<i8"),
+    ("timestamp", "<i8"),
+    ("lat", "<f8"),
+    ("lon", "<f8"),
+    *((nome, "O") for nome in TEXTOS),
+])
+
+
+def _codificar(texto):
+    bruto = b"" if texto is None else str(texto).encode("utf-8")
+    if len(bruto) > MAX_BYTES_TEXTO:
+        raise ValueError(f"valor não cabe no log do snapshot: {str(texto)[:20]!r}...")
+    return bruto
+
+
+def codificar_lote(linhas):
+    """
+    Converte linhas (id, timestamp, tipo, lat, lon, acel, dispositivo) em um
+    lote do log, pronto para um único write.
+    """
+    partes = []
+    quantidade = 0
+    for evento_id, timestamp, tipo, lat, lon, acel, dispositivo in linhas:
+        textos = (tipo, acel, dispositivo)
+        brutos = [_codificar(texto) for texto in textos]
+        nulos = sum(1 << bit for bit, texto in enumerate(textos) if texto is None)
+        partes.append(EVENTO.pack(evento_id, timestamp, lat, lon, nulos, *map(len, brutos)))
+        partes.extend(brutos)
+        quantidade += 1
+    corpo = b"".join(partes)
+    return LOTE.pack(MARCA_LOTE, quantidade, len(corpo), zlib.crc32(corpo)) + corpo
+
+
+def decodificar_lotes(bruto):
+    """
+    Lê os lotes de `bruto` e retorna (linhas na ordem de REGISTRO, bytes
+    lidos). Para no primeiro lote incompleto (queda no meio da escrita) ou
+    corrompido; o que vier depois dele fica para a leitura do DB.
+    """
+    linhas = []
+    posicao = 0
+    while posicao + LOTE.size <= len(bruto):
+        marca, quantidade, tamanho, crc = LOTE.unpack_from(bruto, posicao)
+        inicio = posicao + LOTE.size
+        corpo = bruto[inicio:inicio + tamanho]
+        if marca != MARCA_LOTE or len(corpo) != tamanho or zlib.crc32(corpo) != crc:
+            break
+        atual = 0
+        for _ in range(quantidade):
+            evento_id, timestamp, lat, lon, nulos, *tamanhos = EVENTO.unpack_from(corpo, atual)
+            atual += EVENTO.size
+            textos = []
+            for bit, bytes_texto in enumerate(tamanhos):
+                textos.append(None if nulos & (1 << bit)
+                              else corpo[atual:atual + bytes_texto].decode("utf-8"))
+                atual += bytes_texto
+            linhas.append((evento_id, timestamp, lat, lon, *textos))
+        posicao = inicio + tamanho
+    return linhas, posicao
+
+
+def colunas_de_registros(registros, tabela):
+    """
+    Converte registros do log em colunas no layout do snapshot: tipo e
+    dispositivo recebem o código de `tabela` (um bst.StringTable) e a
+    aceleração vira (valor, formato), como em bst.codificar_acel.
+    """
+    quantidade = len(registros)
+    colunas = {
+        "ts": registros["timestamp"].astype("<i8"),
+        "ids": registros["id"].astype("<i8"),
+        "lat": registros["lat"].astype("<f8"),
+        "lon": registros["lon"].astype("<f8"),
+    }
+    for nome in ("tipo", "dispositivo"):
+        colunas[nome] = np.fromiter((tabela.codigo(texto) for texto in registros[nome]),
+                                    dtype="<u4", count=quantidade)
+    acel = [codificar_acel(texto, tabela) for texto in registros["acel"]]
+    colunas["acel"] = np.fromiter((valor for valor, _ in acel), dtype="<f8", count=quantidade)
+    colunas["acel_formato"] = np.fromiter((formato for _, formato in acel), dtype="u1",
+                                          count=quantidade)
+    return colunas
+
+
+def gravar_snapshot(caminho, colunas, textos, ultimo_id):
+    """
+    Grava o snapshot de forma atômica (arquivo temporário + rename).
+    `colunas` é um bst.EventColumns ordenado por (timestamp, id) e `textos`
+    a lista da tabela de textos a que os códigos se referem.
+    """
+    tabela = json.dumps(textos, separators=(",", ":")).encode("utf-8")
+    # Nome temporário único: workers do gunicorn podem gravar ao mesmo tempo.
+    fd, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho) or ".",
+                                      prefix=os.path.basename(caminho) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as arquivo:
+            arquivo.write(CABECALHO.pack(MAGICO, VERSAO, len(colunas), ultimo_id, len(tabela)))
+            for nome, tipo in COLUNAS:
+                arquivo.write(np.asarray(getattr(colunas, nome), dtype=tipo).tobytes())
+            arquivo.write(tabela)
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, caminho)
+    except BaseException:
+        try:
+            os.unlink(temporario)
+        except OSError:
+            pass
+        raise
+
+
+def ler_snapshot(caminho):
+    """
+    Mapeia o snapshot em memória. Retorna (colunas, textos, ultimo_id), com
+    as colunas (dict nome -> array NumPy) ordenadas por (timestamp, id), ou
+    None se não houver um snapshot válido.
+    """
+    try:
+        with open(caminho, "rb") as arquivo:
+            tamanho = os.fstat(arquivo.fileno()).st_size
+            if tamanho < CABECALHO.size:
+                return None
+            mapa = mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+    except OSError:
+        return None
+
+    magico, versao, quantidade, ultimo_id, bytes_textos = CABECALHO.unpack_from(mapa, 0)
+    bytes_colunas = sum(np.dtype(tipo).itemsize for _, tipo in COLUNAS) * quantidade
+    if (magico != MAGICO or versao != VERSAO
+            or tamanho != CABECALHO.size + bytes_colunas + bytes_textos):
+        mapa.close()
+        return None
+
+    colunas, posicao = {}, CABECALHO.size
+    for nome, tipo in COLUNAS:
+        colunas[nome] = np.frombuffer(mapa, dtype=tipo, count=quantidade, offset=posicao)
+        posicao += colunas[nome].nbytes
+    try:
+        textos = json.loads(mapa[posicao:posicao + bytes_textos].decode("utf-8"))
+    except ValueError:
+        return None
+    if quantidade and any(int(colunas[nome].max()) >= len(textos)
+                          for nome in ("tipo", "dispositivo")):
+        return None
+    # Acelerações guardadas como texto levam no float o código da tabela.
+    codigos_acel = colunas["acel"][colunas["acel_formato"] == ACEL_TEXTO]
+    if len(codigos_acel) and (codigos_acel.min() < 0 or codigos_acel.max() >= len(textos)
+                              or np.any(codigos_acel != np.floor(codigos_acel))):
+        return None
+    return colunas, textos, ultimo_id
+
+
+class EventLog:
+    """
+    Log append-only dos eventos gravados depois do snapshot. Cada lote é
+    escrito com um único write em modo append; um lote incompleto no fim
+    (queda no meio da escrita) é ignorado na leitura.
+
+    Na compactação, o log é renomeado para `anterior` antes de copiar o
+    índice (rotacionar), e só é apagado depois que o snapshot novo foi
+    gravado (descartar_anterior); até lá, ler() inclui os dois arquivos.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.anterior = caminho + ".anterior"
+        self._lock = threading.Lock()
+        self._contagem = (None, 0, 0)  # (inode, bytes já contados, eventos neles)
+        # Se a última leitura parou antes do fim de algum arquivo; os lotes
+        # seguintes só voltam a ser lidos depois de uma compactação.
+        self.incompleto = False
+
+    def append(self, linhas):
+        lote = codificar_lote(linhas)
+        if len(lote) == LOTE.size:
+            return
+        fd = os.open(self.caminho, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, lote)
+        finally:
+            os.close(fd)
+
+    def ler(self):
+        linhas = []
+        self.incompleto = False
+        for caminho in (self.anterior, self.caminho):
+            try:
+                with open(caminho, "rb") as arquivo:
+                    bruto = arquivo.read()
+            except OSError:
+                continue
+            lidas, lidos = decodificar_lotes(bruto)
+            linhas.extend(lidas)
+            self.incompleto |= lidos < len(bruto)
+        registros = np.empty(len(linhas), dtype=REGISTRO)
+        registros[:] = linhas
+        return registros
+
+    def quantidade(self):
+        """
+        Eventos no log atual (sem o anterior). Só lê os cabeçalhos dos lotes
+        acrescentados desde a última chamada, deste ou de outro processo.
+        """
+        with self._lock:
+            try:
+                arquivo = open(self.caminho, "rb")
+            except OSError:
+                return 0
+            with arquivo:
+                estado = os.fstat(arquivo.fileno())
+                inode, posicao, eventos = self._contagem
+                if inode != estado.st_ino or estado.st_size < posicao:
+                    posicao, eventos = 0, 0
+                while posicao + LOTE.size <= estado.st_size:
+                    arquivo.seek(posicao)
+                    marca, quantidade, tamanho, _ = LOTE.unpack(arquivo.read(LOTE.size))
+                    if marca != MARCA_LOTE or posicao + LOTE.size + tamanho > estado.st_size:
+                        break
+                    eventos += quantidade
+                    posicao += LOTE.size + tamanho
+                self._contagem = (estado.st_ino, posicao, eventos)
+                return eventos
+
+    def rotacionar(self):
+        """
+        Passa o log atual para `anterior` e recomeça vazio. Se sobrou um
+        anterior de uma compactação que falhou, o atual é juntado a ele.
+        """
+        try:
+            if os.path.exists(self.anterior):
+                with open(self.caminho, "rb") as atual, open(self.anterior, "ab") as anterior:
+                    anterior.write(atual.read())
+                os.remove(self.caminho)
+            else:
+                os.replace(self.caminho, self.anterior)
+        except FileNotFoundError:
+            pass
+
+    def descartar_anterior(self):
+        try:
+            os.remove(self.anterior)
+        except FileNotFoundError:
+            pass
+
+    def truncar(self):
+        self.descartar_anterior()
+        with open(self.caminho, "wb"):
+            pass
+
+    @contextmanager
+    def exclusivo(self):
+        """
+        Trava entre processos (flock em um arquivo ao lado do log) para uma
+        compactação por vez. Entrega False se outro processo já a tem.
+        """
+        if fcntl is None:
+            yield True
+            return
+        with open(self.caminho + ".trava", "a") as trava:
+            try:
+                fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(trava, fcntl.LOCK_UN)
@@ -0,0 +1,73 @@
+import threading
+from collections import deque
+
+
+class Subscriber:
+    """
+    Fila de um cliente do stream. Tem capacidade limitada: se o cliente não
+    consome rápido o bastante, a fila é descartada e marcada como
+    transbordada, e o stream passa a reler os eventos do índice no ritmo do
+    cliente em vez de acumular memória no servidor.
+    """
+
+    def __init__(self, capacidade):
+        self.capacidade = capacidade
+        self._itens = deque()
+        self._cond = threading.Condition()
+        self._transbordou = False
+
+    def entregar(self, itens):
+        with self._cond:
+            if self._transbordou:
+                return
+            if len(self._itens) + len(itens) > self.capacidade:
+                self._itens.clear()
+                self._transbordou = True
+            else:
+                self._itens.extend(itens)
+            self._cond.notify()
+
+    def aguardar(self, timeout):
+        """Espera por itens; retorna (itens, transbordou)."""
+        with self._cond:
+            if not self._itens and not self._transbordou:
+                self._cond.wait(timeout)
+            itens = list(self._itens)
+            self._itens.clear()
+            return itens, self._transbordou
+
+    def reiniciar(self):
+        """Volta a receber eventos ao vivo depois de uma releitura do índice."""
+        with self._cond:
+            self._itens.clear()
+            self._transbordou = False
+
+
+class EventBroadcaster:
+    """Publish/subscribe em memória: repassa cada lote a todos os inscritos."""
+
+    def __init__(self, capacidade=1000):
+        self._capacidade = capacidade
+        self._lock = threading.Lock()
+        self._inscritos = set()
+
+    def __len__(self):
+        return len(self._inscritos)
+
+    def subscribe(self):
+        inscrito = Subscriber(self._capacidade)
+        with self._lock:
+            self._inscritos.add(inscrito)
+        return inscrito
+
+    def unsubscribe(self, inscrito):
+        with self._lock:
+            self._inscritos.discard(inscrito)
+
+    def publish(self, itens):
+        if not itens:
+            return
+        with self._lock:
+            inscritos = list(self._inscritos)
+        for inscrito in inscritos:
+            inscrito.entregar(itens)